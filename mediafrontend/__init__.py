@@ -5,21 +5,31 @@ import hashlib
 import uuid
 import magic
 import math
-import urllib
 import json
 import subprocess
+import http.client
 import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 
 from flask import url_for, escape, Markup
 from ipaddress import ip_address
-from PIL import Image
+from PIL import Image, ImageStat
 import colorsys
 import dateutil.parser
+from sqlalchemy import Table, Column, LargeBinary, Text, String, Integer
+from sqlalchemy import MetaData, Index
 
 from media import Media, MediumStatus, MediumSearchability, MediumProtection
 from parse_id import get_id_bytes
 from idcollection import IDCollection
 
+from .summary_queue import SummaryQueue
+from .remote_fetch import RemoteFetcher, RemoteFileError
+from .upload_sessions import UploadSessions
+
 categories_to_mimes = {
 	'application':	[
 		'application/x-dosexec',
@@ -211,47 +221,36 @@ def populate_categories(media):
 def get_file_size(file_path):
 	return os.path.getsize(file_path)
 
-def get_file_mime(file_path):
-	mime = magic.Magic(mime=True)
-	return mime.from_file(file_path)
+mime_magic = None
 
-def get_file_id(file_path):
-	chunk_size = 4096
-	hash_algo = hashlib.md5()
+def get_mime_magic():
+	# building a magic handle loads the magic database so reuse one
+	global mime_magic
+	if not mime_magic:
+		mime_magic = magic.Magic(mime=True)
+	return mime_magic
 
-	with open(file_path, 'rb') as f:
-		for chunk in iter(lambda: f.read(chunk_size), b''):
-			hash_algo.update(chunk)
-	return hash_algo.digest()
+def get_buffer_mime(buffer):
+	return get_mime_magic().from_buffer(buffer)
+
+# bytes read from upload streams at a time
+upload_chunk_size = 1048576
+# leading bytes of an upload used to sniff its mimetype
+mime_sniff_size = 1048576
 
 def rgb_average_from_image(image):
-	small_image = image.copy()
+	small_image = summary_source_image(image).copy()
 	small_image.thumbnail((256, 256), Image.BICUBIC)
-	data = list(small_image.getdata())
-	total_pixels = len(data)
-	r = 0
-	g = 0
-	b = 0
-	for pixel in data:
-		#TODO does gif still break this for some reason
-		if isinstance(pixel, int):
-			return 0, 0, 0
-		if 4 == len(pixel):
-			pr, pg, pb, pa = pixel
-			if 0 == pa:
-				total_pixels -= 1
-				continue
-		elif 3 == len(pixel):
-			(pr, pg, pb) = pixel
-		else:
+	mask = None
+	if small_image.mode in ['RGBA', 'LA']:
+		# fully transparent pixels don't count towards the average
+		mask = small_image.getchannel('A').point(lambda a: 255 if a else 0)
+		if not mask.getbbox():
 			return 0, 0, 0
-		r += pr
-		g += pg
-		b += pb
-	r = round(r / total_pixels)
-	g = round(g / total_pixels)
-	b = round(b / total_pixels)
-	return r, g, b
+	if 'RGB' != small_image.mode:
+		small_image = small_image.convert('RGB')
+	r, g, b = ImageStat.Stat(small_image, mask).mean
+	return round(r), round(g), round(b)
 
 def hsv_average_from_image(image):
 	return colorsys.rgb_to_hsv(*rgb_average_from_image(image))
@@ -294,6 +293,141 @@ def is_websafe_video(mime):
 		return True
 	return False
 
+def skip_gif_sub_blocks(f):
+	while True:
+		size = f.read(1)
+		if not size or 0 == size[0]:
+			return
+		f.seek(size[0], 1)
+
+def get_gif_info(file_path):
+	# count frames and sum frame delays by walking the gif blocks
+	# without decompressing any image data
+	frames = 0
+	duration_ms = 0
+	with open(file_path, 'rb') as f:
+		header = f.read(13)
+		if 13 > len(header) or b'GIF' != header[:3]:
+			return frames, duration_ms
+		flags = header[10]
+		# global color table
+		if flags & 0x80:
+			f.seek(3 * (2 << (flags & 0x07)), 1)
+		delay = 0
+		while True:
+			introducer = f.read(1)
+			# trailer or truncated file
+			if not introducer or b'\x3b' == introducer:
+				break
+			# extension
+			if b'\x21' == introducer:
+				label = f.read(1)
+				size = f.read(1)
+				if not label or not size:
+					break
+				data = f.read(size[0])
+				# graphic control extension delay is in hundredths of a second
+				if b'\xf9' == label and 3 <= len(data):
+					delay = int.from_bytes(data[1:3], 'little')
+				if size[0]:
+					skip_gif_sub_blocks(f)
+			# image descriptor
+			elif b'\x2c' == introducer:
+				descriptor = f.read(9)
+				if 9 > len(descriptor):
+					break
+				flags = descriptor[8]
+				# local color table
+				if flags & 0x80:
+					f.seek(3 * (2 << (flags & 0x07)), 1)
+				# lzw minimum code size
+				f.read(1)
+				skip_gif_sub_blocks(f)
+				frames += 1
+				duration_ms += delay * 10
+				delay = 0
+			else:
+				break
+	return frames, duration_ms
+
+def summary_thumbnail_size(width, height, edge):
+	# for non-square images the shortest edge dimension is the thumbnail edge
+	# and images already at or under the thumbnail edge aren't upscaled
+	shortest_edge = min(width, height)
+	if shortest_edge <= edge:
+		return width, height
+	scale = edge / shortest_edge
+	return max(1, round(width * scale)), max(1, round(height * scale))
+
+def summary_source_image(image):
+	# normalize to a mode that can be shared as a raw buffer
+	if image.mode in ['RGB', 'RGBA', 'L', 'LA']:
+		return image
+	if (
+			image.mode in ['P', 'PA', 'RGBa']
+			or 'transparency' in image.info
+		):
+		return image.convert('RGBA')
+	return image.convert('RGB')
+
+def reduce_to_pixel_budget(image, edge, pixel_budget):
+	# integer box reduce oversized sources without going under the summary edge
+	if not pixel_budget or image.width * image.height <= pixel_budget:
+		return image
+	factor = math.ceil(math.sqrt(image.width * image.height / pixel_budget))
+	factor = min(factor, math.floor(min(image.width, image.height) / edge))
+	if 1 >= factor:
+		return image
+	return image.reduce(factor)
+
+def save_summary(image, format, output_path):
+	if 'WebP' == format:
+		image.save(output_path, 'WebP', quality=90)
+	else:
+		image.save(output_path, 'PNG', optimize=True)
+
+def save_shared_summary(shm_name, mode, size, format, output_path):
+	shm = shared_memory.SharedMemory(name=shm_name)
+	try:
+		image = Image.frombuffer(mode, size, shm.buf, 'raw', mode, 0, 1)
+		save_summary(image, format, output_path)
+		# release the buffer export before closing the shared memory
+		del image
+	finally:
+		shm.close()
+
+summary_encode_pools = {}
+
+def get_summary_encode_pool(processes):
+	if processes not in summary_encode_pools:
+		summary_encode_pools[processes] = ProcessPoolExecutor(
+			max_workers=processes,
+		)
+	return summary_encode_pools[processes]
+
+# ids of every medium by db prefix, shared by all requests in this process
+known_medium_ids = {}
+known_medium_ids_lock = threading.Lock()
+
+# names of frontend tables already checked for by this process
+checked_tables = set()
+
+# compiled clutter tag prefixes and memoized results by configured prefixes
+clutter_tag_classifiers = {}
+clutter_tag_memo_size = 65536
+
+def compile_tag_prefixes(prefixes):
+	if not prefixes:
+		return None
+	return re.compile('|'.join([re.escape(prefix) for prefix in prefixes]))
+
+remote_fetch_pools = {}
+
+def get_remote_fetch_pool(threads):
+	if threads not in remote_fetch_pools:
+		remote_fetch_pools[threads] = ThreadPoolExecutor(max_workers=threads)
+	return remote_fetch_pools[threads]
+
 def move(source, dest): 
 	try:
 		os.rename(source, dest)
@@ -301,6 +435,185 @@ def move(source, dest):
 		shutil.copyfile(source, dest)
 		os.remove(source)
 
+# update fields compared and applied as enums
+updated_enum_fields = {
+	'status': MediumStatus,
+	'protection': MediumProtection,
+	'searchability': MediumSearchability,
+}
+
+# update fields applied to the medium directly instead of refetching it
+mirrored_update_fields = [
+	'status',
+	'protection',
+	'searchability',
+	'focus',
+	'data1',
+	'data2',
+	'data3',
+	'data4',
+	'data5',
+	'data6',
+]
+
+def shard_parts(medium_id, depth):
+	# nest files under directories named for leading pairs of id characters
+	parts = []
+	for i in range(depth):
+		parts.append(medium_id[i * 2:i * 2 + 2])
+	return parts
+
+def manifest_shard_depth(manifest):
+	if None == manifest:
+		return None
+	for entry in manifest:
+		if entry.startswith('shards:'):
+			return int(entry[len('shards:'):])
+	return 0
+
+def manifest_linked(manifest):
+	return None != manifest and 'linked' in manifest
+
+def manifest_version(manifest):
+	if None == manifest:
+		return ''
+	for entry in manifest:
+		if entry.startswith('version:'):
+			return entry[len('version:'):]
+	return ''
+
+def manifest_with_version(files, version):
+	files = set(file for file in files if not file.startswith('version:'))
+	if version:
+		files.add('version:' + version)
+	return files
+
+def manifest_with_layout(files, depth, linked=False):
+	files = set(
+		file for file in files
+		if not file.startswith('shards:') and 'linked' != file
+	)
+	if 0 < depth:
+		files.add('shards:' + str(depth))
+	if linked:
+		files.add('linked')
+	return files
+
+# tag prefixes parsed into semantic tags
+semantic_tag_prefixes = (
+	'prev:',
+	'next:',
+	'inferior of:',
+	'superior of:',
+	'mirror:',
+	'url:',
+	'source url:',
+	'creator url:',
+	'character url:',
+	'title:',
+	'author:',
+	'cover:',
+	'set:',
+	'text:',
+	'blurb:',
+	'embed:',
+)
+
+def is_semantic_tag(tag):
+	return tag.startswith(semantic_tag_prefixes)
+
+def parse_semantic_tags(tags):
+	# raw blurbs are kept as plain html strings so the result serializes
+	semantic_tags = {}
+	for tag in tags:
+		if 'prev:' == tag[:5]:
+			semantic_tags['prev'] = tag[5:]
+		elif 'next:' == tag[:5]:
+			semantic_tags['next'] = tag[5:]
+		elif 'inferior of:' == tag[:12]:
+			semantic_tags['inferior of'] = tag[12:]
+		elif 'superior of:' == tag[:12]:
+			semantic_tags['superior of'] = tag[12:]
+		elif 'mirror:' == tag[:7]:
+			if 'mirror' not in semantic_tags:
+				semantic_tags['mirror'] = []
+			semantic_tags['mirror'].append(tag[7:])
+		elif 'url:' == tag[:4]:
+			if 'url' not in semantic_tags:
+				semantic_tags['url'] = []
+			semantic_tags['url'].append(tag[4:])
+		elif 'source url:' == tag[:11]:
+			if 'source url' not in semantic_tags:
+				semantic_tags['source url'] = []
+			semantic_tags['source url'].append(tag[11:])
+		elif 'creator url:' == tag[:12]:
+			if 'creator url' not in semantic_tags:
+				semantic_tags['creator url'] = []
+			semantic_tags['creator url'].append(tag[12:])
+		elif 'character url:' == tag[:14]:
+			if 'character url' not in semantic_tags:
+				semantic_tags['character url'] = []
+			semantic_tags['character url'].append(tag[14:])
+		elif 'title:' == tag[:6]:
+			semantic_tags['title'] = tag[6:]
+		elif 'author:' == tag[:7]:
+			semantic_tags['author'] = tag[7:]
+		elif 'cover:' == tag[:6]:
+			semantic_tags['cover'] = tag[6:]
+		elif 'set:' == tag[:4]:
+			if 'sets' not in semantic_tags:
+				semantic_tags['sets'] = []
+			set_name = tag[4:]
+			weight_colon_pos = set_name.find(':')
+			if -1 < weight_colon_pos:
+				set_name = set_name[:weight_colon_pos]
+			semantic_tags['sets'].append(set_name)
+		elif 'text:' == tag[:5]:
+			semantic_tags['text'] = tag[5:]
+		elif 'blurb:' == tag[:6]:
+			if 'raw:' == tag[6:10]:
+				semantic_tags['blurb'] = (
+					'<p>'+ tag[10:].replace('\\n', '<br>') + '</p>'
+				)
+			else:
+				semantic_tags['blurb medium'] = tag[6:]
+		elif 'embed:' == tag[:6]:
+			semantic_tags['embed'] = tag[6:]
+	return semantic_tags
+
+def parse_set_memberships(tags):
+	# lowest weight by set name, none for unweighted members
+	memberships = {}
+	for tag in tags:
+		if 'set:' != tag[:4]:
+			continue
+		set_name = tag[4:]
+		weight = None
+		weight_colon_pos = set_name.find(':')
+		if -1 < weight_colon_pos:
+			weight = set_name[weight_colon_pos + 1:]
+			set_name = set_name[:weight_colon_pos]
+		if set_name in memberships and (
+				None == weight
+				or (None != memberships[set_name] and memberships[set_name] <= weight)
+			):
+			continue
+		memberships[set_name] = weight
+	return memberships
+
+def link_public_file(target, link_path, public):
+	# public files are relative symlinks into the protected tree
+	# so a whole media root can be relocated
+	if public:
+		if not os.path.lexists(link_path):
+			os.makedirs(os.path.dirname(link_path), exist_ok=True)
+			os.symlink(
+				os.path.relpath(target, os.path.dirname(link_path)),
+				link_path,
+			)
+	elif os.path.islink(link_path):
+		os.remove(link_path)
+
 class MediaFrontend(Media):
 	def __init__(
 			self,
@@ -310,6 +623,7 @@ class MediaFrontend(Media):
 			engine,
 			install=False,
 			connection=None,
+			identity_map=False,
 		):
 		super().__init__(
 			engine,
@@ -334,6 +648,86 @@ class MediaFrontend(Media):
 
 		self.external_uris = False
 
+		clutter_tag_prefixes = tuple(self.config['clutter_tag_prefixes'])
+		if clutter_tag_prefixes not in clutter_tag_classifiers:
+			clutter_tag_classifiers[clutter_tag_prefixes] = {
+				'pattern': compile_tag_prefixes(clutter_tag_prefixes),
+				'results': {},
+			}
+		self.clutter_tag_classifier = clutter_tag_classifiers[clutter_tag_prefixes]
+
+		# populated media by id bytes for instances that live for one request
+		self.identity_map = None
+		if identity_map:
+			self.identity_map = {}
+		self.identity_map_stats = {'hits': 0, 'misses': 0}
+
+		self.summary_timings = {}
+
+		metadata = MetaData()
+		self.summary_metadata = Table(
+			config['db_prefix'] + 'media_summary_metadata',
+			metadata,
+			Column('medium_id', LargeBinary(16), primary_key=True),
+			Column('info', Text),
+			Column('artifacts', Text),
+		)
+		# suffixes of the original and summary files present on disk
+		# so uris can be built without checking the filesystem
+		self.file_manifests = Table(
+			config['db_prefix'] + 'media_file_manifests',
+			metadata,
+			Column('medium_id', LargeBinary(16), primary_key=True),
+			Column('files', Text),
+		)
+		# semantic tags parsed when tags are written instead of on every read
+		self.semantic_tags = Table(
+			config['db_prefix'] + 'media_semantic_tags',
+			metadata,
+			Column('medium_id', LargeBinary(16), primary_key=True),
+			Column('semantic', Text),
+		)
+		# members of each set in display order
+		# weighted members by weight then the rest by creation time
+		self.set_members = Table(
+			config['db_prefix'] + 'media_set_members',
+			metadata,
+			Column('set_name', String(self.tag_length), primary_key=True),
+			Column('medium_id', LargeBinary(16), primary_key=True),
+			Column('weight', String(self.tag_length)),
+			Column('creation_time', Integer),
+			Index(config['db_prefix'] + 'media_set_members_medium_id', 'medium_id'),
+		)
+		# created on first use too so upgraded installs get tables added
+		# since they were installed, checked once per process
+		for table in [
+				self.summary_metadata,
+				self.file_manifests,
+				self.semantic_tags,
+				self.set_members,
+			]:
+			if install or table.name not in checked_tables:
+				table.create(bind=self.engine, checkfirst=True)
+				checked_tables.add(table.name)
+
+		# shared by every remote fetch from this instance
+		# so a batch of imports reuses keep-alive connections
+		self.remote_fetcher = None
+		self.remote_fetcher_lock = threading.Lock()
+
+		self.upload_sessions = UploadSessions(
+			self.config['temp_path'],
+			self.config['maximum_resumable_upload_filesize'],
+			session_period=self.config['upload_session_period'],
+		)
+
+		self.summary_queue = None
+		if self.config['summary_queue_path']:
+			self.summary_queue = SummaryQueue(
+				self.config['summary_queue_path'],
+				stale_job_period=self.config['summary_job_stale_period'],
+			)
+
 		self.callbacks = {}
 
 	def add_callback(self, name, f):
@@ -375,28 +769,109 @@ class MediaFrontend(Media):
 
 	# extend media methods
 	def get_medium(self, medium_id):
+		if None != self.identity_map:
+			try:
+				medium_id_bytes = get_id_bytes(medium_id)
+			except ValueError:
+				medium_id_bytes = None
+			if medium_id_bytes in self.identity_map:
+				self.identity_map_stats['hits'] += 1
+				return self.identity_map[medium_id_bytes]
+			self.identity_map_stats['misses'] += 1
 		medium = super().get_medium(medium_id)
 		if medium:
 			self.populate_media_tags(medium)
+			self.populate_media_manifests(medium)
+			self.populate_media_semantic_tags(medium)
 			self.populate_medium_properties(medium)
+			self.remember_medium(medium)
 		return medium
 
 	def search_media(self, **kwargs):
 		media = super().search_media(**kwargs)
-		self.populate_media_tags(media)
-		for medium in media.values():
-			self.populate_medium_properties(medium)
+		unpopulated = IDCollection()
+		for key, medium in list(media.items()):
+			if None != self.identity_map and medium.id_bytes in self.identity_map:
+				self.identity_map_stats['hits'] += 1
+				media[key] = self.identity_map[medium.id_bytes]
+				continue
+			if None != self.identity_map:
+				self.identity_map_stats['misses'] += 1
+			unpopulated.add(medium)
+		if unpopulated:
+			self.populate_media_tags(unpopulated)
+			self.populate_media_manifests(unpopulated)
+			self.populate_media_semantic_tags(unpopulated)
+			context = self.population_context()
+			for medium in unpopulated.values():
+				self.populate_medium_properties(medium, context)
+				self.remember_medium(medium)
 		return media
 
+	def remember_medium(self, medium):
+		if None != self.identity_map:
+			self.identity_map[medium.id_bytes] = medium
+
+	def forget_media(self, medium_ids):
+		if None == self.identity_map:
+			return
+		if list != type(medium_ids):
+			medium_ids = [medium_ids]
+		for medium_id in medium_ids:
+			try:
+				self.identity_map.pop(get_id_bytes(medium_id), None)
+			except ValueError:
+				pass
+
+	def set_tags(self, medium_ids, tags):
+		super().set_tags(medium_ids, tags)
+		self.forget_media(medium_ids)
+		# replaced tags may have been semantic even if the new ones aren't
+		self.store_semantic_tags(medium_ids)
+
+	def add_tags(self, medium_ids, tags):
+		super().add_tags(medium_ids, tags)
+		self.forget_media(medium_ids)
+		if list != type(tags):
+			tags = [tags]
+		if [tag for tag in tags if is_semantic_tag(tag)]:
+			self.store_semantic_tags(medium_ids)
+
+	def remove_tags(self, medium_ids, tags):
+		super().remove_tags(medium_ids, tags)
+		self.forget_media(medium_ids)
+		if list != type(tags):
+			tags = [tags]
+		if [tag for tag in tags if is_semantic_tag(tag)]:
+			self.store_semantic_tags(medium_ids)
+
+	def delete_tags(self, tags):
+		if list != type(tags):
+			tags = [tags]
+		affected_medium_ids = set()
+		for tag in tags:
+			if is_semantic_tag(tag):
+				affected_medium_ids.update(self.load_medium_ids({'with_tags': tag}))
+		super().delete_tags(tags)
+		# tags may have been removed from any medium
+		if None != self.identity_map:
+			self.identity_map = {}
+		if affected_medium_ids:
+			self.store_semantic_tags(list(affected_medium_ids))
+
 	def create_medium(self, **kwargs):
 		medium = super().create_medium(**kwargs)
 		subject_id = ''
 		if self.accounts.current_user:
 			subject_id = self.accounts.current_user.id_bytes
+		if self.config['db_prefix'] in known_medium_ids:
+			known_medium_ids[self.config['db_prefix']]['ids'].add(medium.id_bytes)
+		medium.manifest = None
+		medium.stored_semantic_tags = None
 		self.populate_medium_properties(medium)
 		return medium
 
-	def update_medium(self, medium_id, **kwargs):
+	def update_medium(self, medium_id, medium=None, **kwargs):
 		# uploader remote origin and uploader id can't be changed after upload
 		if 'uploader_remote_origin' in kwargs:
 			del kwargs['uploader_remote_origin']
@@ -411,18 +886,77 @@ class MediaFrontend(Media):
 			):
 			if 'status' in kwargs:
 				del kwargs['status']
-		super().update_medium(medium_id, **kwargs)
-		# fetch medium after updates
-		medium = self.get_medium(medium_id)
+		# callers that already have the medium pass it to skip fetching it
 		if not medium:
-			return
-		self.place_medium_file(medium)
-		self.place_medium_summaries(medium)
+			medium = self.get_medium(medium_id)
+			if not medium:
+				return None
+		changes = {}
+		for field, value in kwargs.items():
+			if field in updated_enum_fields and str == type(value):
+				try:
+					value = updated_enum_fields[field][value.upper()]
+				except KeyError:
+					# leave invalid values for the base update to reject
+					pass
+			current = getattr(medium, field, None)
+			# group bits are passed as ints but populated as bytes
+			if 'group_bits' == field and bytes == type(current) and int == type(value):
+				current = int.from_bytes(current, 'big')
+			if not hasattr(medium, field) or value != current:
+				changes[field] = value
+		if not changes:
+			return medium
+		previous_protection_path = self.medium_protection_path(medium)
+		super().update_medium(medium_id, **changes)
+		self.forget_media(medium_id)
+		if 'creation_time' in changes:
+			self.connection.execute(
+				self.set_members.update().where(
+					self.set_members.c.medium_id == medium.id_bytes
+				).values(creation_time=changes['creation_time'])
+			)
+		if [field for field in changes if field not in mirrored_update_fields]:
+			# other fields may be stored differently than they're passed
+			medium = self.get_medium(medium_id)
+			if not medium:
+				return None
+		else:
+			for field, value in changes.items():
+				setattr(medium, field, value)
+			self.populate_medium_properties(medium)
+		# files only move when the medium crosses between protection paths
+		if previous_protection_path != self.medium_protection_path(medium):
+			self.place_medium_file(medium)
+			self.place_medium_summaries(medium)
+			# placement moves files into the configured layout
+			if (
+					None != medium.manifest
+					and not self.manifest_layout_current(medium.manifest)
+				):
+				medium.manifest = manifest_with_layout(
+					medium.manifest,
+					self.config['shard_depth'],
+					self.config['link_public_files'],
+				)
+				self.set_file_manifest(medium.id_bytes, medium.manifest)
+				self.populate_medium_uris(medium)
+		self.remember_medium(medium)
+		return medium
 
 	def remove_medium(self, medium):
 		self.delete_medium_file(medium)
 		self.delete_medium_summaries(medium)
+		self.delete_summary_metadata(medium.id_bytes)
+		self.delete_file_manifest(medium.id_bytes)
+		self.delete_semantic_tags(medium.id_bytes)
+		self.delete_set_memberships(medium.id_bytes)
+		if self.summary_queue:
+			self.summary_queue.remove(medium.id_bytes)
+		if self.config['db_prefix'] in known_medium_ids:
+			known_medium_ids[self.config['db_prefix']]['ids'].discard(medium.id_bytes)
 		super().delete_medium(medium.id_bytes)
+		self.forget_media(medium.id_bytes)
 		subject_id = ''
 		if self.accounts.current_user:
 			subject_id = self.accounts.current_user.id_bytes
@@ -449,6 +983,15 @@ class MediaFrontend(Media):
 		)
 
 	#additional media methods
+	def is_clutter_tag(self, tag):
+		results = self.clutter_tag_classifier['results']
+		if tag not in results:
+			if clutter_tag_memo_size <= len(results):
+				results.clear()
+			pattern = self.clutter_tag_classifier['pattern']
+			results[tag] = None != pattern and None != pattern.match(tag)
+		return results[tag]
+
 	def tag_string_to_list(self, tag_string):
 		return tag_string.split('#')
 
@@ -676,22 +1219,47 @@ class MediaFrontend(Media):
 
 		return filter
 
-	def populate_medium_uris(self, medium):
+	def population_context(self):
+		# values shared by every medium populated in one pass
+		context = {
+			'group_bits': [],
+			'groups': {},
+			'is_manager': False,
+			'group_permissions': {},
+			'protected_uris': None,
+		}
+		for group in self.config['requirable_groups']:
+			group_bit = self.accounts.group_name_to_bit(group)
+			if int.from_bytes(group_bit, 'big'):
+				context['group_bits'].append((group, group_bit))
+		if self.accounts.current_user:
+			context['is_manager'] = self.accounts.current_user.has_permission(
+				group_names='manager'
+			)
+		return context
+
+	def populate_medium_uris(self, medium, context=None):
+		if not context:
+			context = self.population_context()
 		if (
 				MediumProtection.NONE != medium.protection
 				or MediumStatus.ALLOWED != medium.status
 			):
 			protection_path = 'protected'
-			media_uri = url_for(
-				'media_api.api_fetch_medium',
-				medium_filename='MEDIUM_FILENAME',
-				_external=self.external_uris,
-			).replace('MEDIUM_FILENAME', '{}')
-			summaries_uri = url_for(
-				'media_api.api_fetch_summary',
-				summary_filename='SUMMARY_FILENAME',
-				_external=self.external_uris,
-			).replace('SUMMARY_FILENAME', '{}')
+			if not context['protected_uris']:
+				context['protected_uris'] = (
+					url_for(
+						'media_api.api_fetch_medium',
+						medium_filename='MEDIUM_FILENAME',
+						_external=self.external_uris,
+					).replace('MEDIUM_FILENAME', '{}'),
+					url_for(
+						'media_api.api_fetch_summary',
+						summary_filename='SUMMARY_FILENAME',
+						_external=self.external_uris,
+					).replace('SUMMARY_FILENAME', '{}'),
+				)
+			media_uri, summaries_uri = context['protected_uris']
 		else:
 			protection_path = 'nonprotected'
 			media_uri = self.config['medium_file_uri']
@@ -709,171 +1277,139 @@ class MediaFrontend(Media):
 		}
 
 		medium_file = medium.id + '.' + mime_to_extension(medium.mime)
-		if os.path.exists(
-				os.path.join(
-					self.config['media_path'],
-					protection_path,
-					medium_file,
+		depth = manifest_shard_depth(medium.manifest)
+		if None == depth:
+			depth = self.find_medium_shard_depth(medium, [protection_path])
+		if None == depth:
+			depth = self.config['shard_depth']
+		if 'nonprotected' == protection_path and 0 < depth:
+			shard_uri_path = '/'.join(shard_parts(medium.id, depth)) + '/{}'
+			media_uri = media_uri.format(shard_uri_path)
+			summaries_uri = summaries_uri.format(shard_uri_path)
+
+		summary_path = self.medium_directory(
+			'summaries_path',
+			protection_path,
+			medium,
+			depth,
+		)
+		def file_exists(suffix):
+			# media without a manifest yet fall back to checking the filesystem
+			if None != medium.manifest:
+				return suffix in medium.manifest
+			if 'original' == suffix:
+				return os.path.exists(
+					os.path.join(
+						self.medium_directory(
+							'media_path',
+							protection_path,
+							medium,
+							depth,
+						),
+						medium_file,
+					)
 				)
-			):
+			return os.path.exists(
+				os.path.join(summary_path, medium.id + '.' + suffix)
+			)
+
+		if file_exists('original'):
 			medium.uris['original'] = media_uri.format(medium_file)
 
-		summary_path = os.path.join(
-			self.config['summaries_path'],
-			protection_path,
-		)
 		for edge in self.config['summary_edges']:
 			summary_file = medium.id + '.' + str(edge)
 			if 'image' == medium.category:
-				if os.path.exists(
-						os.path.join(summary_path, summary_file + '.webp')
-					):
+				if file_exists(str(edge) + '.webp'):
 					medium.uris['static'][edge] = summaries_uri.format(
 						summary_file + '.webp'
 					)
-				if os.path.exists(
-						os.path.join(summary_path, summary_file + '.png')
-					):
+				if file_exists(str(edge) + '.png'):
 					medium.uris['fallback'][edge] = summaries_uri.format(
 						summary_file + '.png'
 					)
 				if (
 						'image/gif' == medium.mime
 						and 1 < medium.data4
-						and os.path.exists(
-							os.path.join(summary_path, summary_file + '.gif')
-						)
+						and file_exists(str(edge) + '.gif')
 					):
 					medium.uris['reencoded'][edge] = summaries_uri.format(
 						summary_file + '.gif'
 					)
 			elif 'video' == medium.category:
-				if os.path.exists(
-						os.path.join(summary_path, summary_file + '.webp')
-					):
+				if file_exists(str(edge) + '.webp'):
 					medium.uris['static'][edge] = summaries_uri.format(
 						summary_file + '.webp'
 					)
-				if os.path.exists(
-						os.path.join(summary_path, summary_file + '.png')
-					):
+				if file_exists(str(edge) + '.png'):
 					medium.uris['fallback'][edge] = summaries_uri.format(
 						summary_file + '.png'
 					)
 
 			elif medium.category in ['audio', 'archive']:
-				if os.path.exists(
-						os.path.join(summary_path, summary_file + '.webp')
-					):
+				if file_exists(str(edge) + '.webp'):
 					medium.uris['static'][edge] = summaries_uri.format(
 						summary_file + '.webp'
 					)
-				if os.path.exists(
-						os.path.join(summary_path, summary_file + '.png')
-					):
+				if file_exists(str(edge) + '.png'):
 					medium.uris['fallback'][edge] = summaries_uri.format(
 						summary_file + '.png'
 					)
 		if 'video' == medium.category:
-			if os.path.exists(
-					os.path.join(summary_path,  medium.id + '.clip.webm')
-				):
+			if file_exists('clip.webm'):
 				medium.uris['reencoded']['clip'] = summaries_uri.format(
 					medium.id + '.clip.webm'
 				)
-			if os.path.exists(
-					os.path.join(summary_path,  medium.id + '.slideshow.webp')
-				):
+			if file_exists('slideshow.webp'):
 				medium.uris['static']['slideshow'] = summaries_uri.format(
 					medium.id + '.slideshow.webp'
 				)
-			if os.path.exists(
-					os.path.join(summary_path,  medium.id + '.slideshow.png')
-				):
+			if file_exists('slideshow.png'):
 				medium.uris['fallback']['slideshow'] = summaries_uri.format(
 					medium.id + '.slideshow.png'
 				)
 			if (
 					not is_websafe_video(medium.mime)
-					and os.path.exists(
-						os.path.join(summary_path, medium.id + '.reencoded.webm')
-					)
+					and file_exists('reencoded.webm')
 				):
 				medium.uris['reencoded']['original'] = summaries_uri.format(
 					medium.id + '.reencoded.webm'
 				)
 
-	def populate_medium_groups(self, medium):
-		medium.groups = []
-		for group in self.config['requirable_groups']:
-			group_bit = self.accounts.group_name_to_bit(group)
-			if not int.from_bytes(group_bit, 'big'):
-				continue
-			if self.accounts.contains_all_bits(medium.group_bits, group_bit):
-				medium.groups.append(group)
+		version = manifest_version(medium.manifest)
+		if version:
+			for uri_group in ['static', 'fallback', 'reencoded']:
+				for key, uri in medium.uris[uri_group].items():
+					medium.uris[uri_group][key] = uri + '?v=' + version
+
+	def populate_medium_groups(self, medium, context=None):
+		if not context:
+			context = self.population_context()
+		if medium.group_bits not in context['groups']:
+			groups = []
+			for group, group_bit in context['group_bits']:
+				if self.accounts.contains_all_bits(medium.group_bits, group_bit):
+					groups.append(group)
+			context['groups'][medium.group_bits] = groups
+		medium.groups = list(context['groups'][medium.group_bits])
 
 	def populate_medium_semantic_tags(self, medium):
+		semantic_tags = medium.stored_semantic_tags
+		# media stored before semantic tags were persisted are parsed on read
+		if None == semantic_tags:
+			semantic_tags = parse_semantic_tags(medium.tags)
 		medium.semantic_tags = {}
-		for tag in medium.tags:
-			if 'prev:' == tag[:5]:
-				medium.semantic_tags['prev'] = tag[5:]
-			elif 'next:' == tag[:5]:
-				medium.semantic_tags['next'] = tag[5:]
-			elif 'inferior of:' == tag[:12]:
-				medium.semantic_tags['inferior of'] = tag[12:]
-			elif 'superior of:' == tag[:12]:
-				medium.semantic_tags['superior of'] = tag[12:]
-			elif 'mirror:' == tag[:7]:
-				if 'mirror' not in medium.semantic_tags:
-					medium.semantic_tags['mirror'] = []
-				medium.semantic_tags['mirror'].append(tag[7:])
-			elif 'url:' == tag[:4]:
-				if 'url' not in medium.semantic_tags:
-					medium.semantic_tags['url'] = []
-				medium.semantic_tags['url'].append(tag[4:])
-			elif 'source url:' == tag[:11]:
-				if 'source url' not in medium.semantic_tags:
-					medium.semantic_tags['source url'] = []
-				medium.semantic_tags['source url'].append(tag[11:])
-			elif 'creator url:' == tag[:12]:
-				if 'creator url' not in medium.semantic_tags:
-					medium.semantic_tags['creator url'] = []
-				medium.semantic_tags['creator url'].append(tag[12:])
-			elif 'character url:' == tag[:14]:
-				if 'character url' not in medium.semantic_tags:
-					medium.semantic_tags['character url'] = []
-				medium.semantic_tags['character url'].append(tag[14:])
-			elif 'title:' == tag[:6]:
-				medium.semantic_tags['title'] = tag[6:]
-			elif 'author:' == tag[:7]:
-				medium.semantic_tags['author'] = tag[7:]
-			elif 'cover:' == tag[:6]:
-				medium.semantic_tags['cover'] = tag[6:]
-			elif 'set:' == tag[:4]:
-				if 'sets' not in medium.semantic_tags:
-					medium.semantic_tags['sets'] = []
-				set_name = tag[4:]
-				weight_colon_pos = set_name.find(':')
-				if -1 < weight_colon_pos:
-					set_name = set_name[:weight_colon_pos]
-				medium.semantic_tags['sets'].append(set_name)
-			elif 'text:' == tag[:5]:
-				medium.semantic_tags['text'] = tag[5:]
-			elif 'blurb:' == tag[:6]:
-				if 'raw:' == tag[6:10]:
-					medium.semantic_tags['blurb'] = (
-						Markup('<p>'+ tag[10:].replace('\\n', '<br>') + '</p>')
-					)
-				else:
-					medium.semantic_tags['blurb medium'] = tag[6:]
-			elif 'embed:' == tag[:6]:
-				medium.semantic_tags['embed'] = tag[6:]
-
-	def current_user_medium_response_code(self, medium):
+		for name, value in semantic_tags.items():
+			if list == type(value):
+				value = value.copy()
+			medium.semantic_tags[name] = value
+		if 'blurb' in medium.semantic_tags:
+			medium.semantic_tags['blurb'] = Markup(medium.semantic_tags['blurb'])
+
+	def current_user_medium_response_code(self, medium, context=None):
+		if not context:
+			context = self.population_context()
 		if self.accounts.current_user:
-			if self.accounts.current_user.has_permission(
-					group_names='manager'
-				):
+			if context['is_manager']:
 				return 200
 			if MediumStatus.FORBIDDEN == medium.status:
 				return 404
@@ -885,12 +1421,14 @@ class MediaFrontend(Media):
 				return 200
 			if MediumProtection.PRIVATE == medium.protection:
 				return 404
-			if (
+			if medium.group_bits not in context['group_permissions']:
+				context['group_permissions'][medium.group_bits] = (
 					0 == int.from_bytes(medium.group_bits, 'big')
 					or self.accounts.current_user.has_permission(
 						group_bits=medium.group_bits,
 					)
-				):
+				)
+			if context['group_permissions'][medium.group_bits]:
 				return 200
 		if MediumStatus.FORBIDDEN == medium.status:
 			return 404
@@ -905,12 +1443,17 @@ class MediaFrontend(Media):
 				return 402
 		return 403
 
-	def populate_medium_properties(self, medium):
+	def populate_medium_properties(self, medium, context=None):
+		if not context:
+			context = self.population_context()
 		populate_category(medium)
-		self.populate_medium_uris(medium)
-		self.populate_medium_groups(medium)
+		self.populate_medium_uris(medium, context)
+		self.populate_medium_groups(medium, context)
 		self.populate_medium_semantic_tags(medium)
-		medium.current_user_response_code = self.current_user_medium_response_code(medium)
+		medium.current_user_response_code = self.current_user_medium_response_code(
+			medium,
+			context,
+		)
 		if medium.category in ['image', 'video'] and medium.data3:
 			r, g, b = hsv_int_to_rgb(medium.data3)
 			medium.rgb = {
@@ -991,6 +1534,49 @@ class MediaFrontend(Media):
 		for medium in media_with_covers:
 			medium.cover = cover_media.get(medium.cover_id)
 
+	def populate_media_manifests(self, media):
+		if IDCollection == type(media):
+			media = list(media.values())
+		if list != type(media):
+			media = [media]
+		for medium in media:
+			medium.manifest = None
+		if not media:
+			return
+		manifests = self.get_file_manifests([medium.id_bytes for medium in media])
+		for medium in media:
+			medium.manifest = manifests.get(medium.id_bytes)
+
+	def populate_media_semantic_tags(self, media):
+		if IDCollection == type(media):
+			media = list(media.values())
+		if list != type(media):
+			media = [media]
+		for medium in media:
+			medium.stored_semantic_tags = None
+		if not media:
+			return
+		semantic_tags = self.get_semantic_tags(
+			[medium.id_bytes for medium in media]
+		)
+		for medium in media:
+			medium.stored_semantic_tags = semantic_tags.get(medium.id_bytes)
+
+	def populate_media_summary_jobs(self, media):
+		if IDCollection == type(media):
+			media = list(media.values())
+		if list != type(media):
+			media = [media]
+		for medium in media:
+			medium.summary_job = ''
+		if not self.summary_queue or not media:
+			return
+		statuses = self.summary_queue.get_statuses(
+			[medium.id_bytes for medium in media]
+		)
+		for medium in media:
+			medium.summary_job = statuses.get(medium.id_bytes, '')
+
 	def populate_medium_contents(self, medium):
 		medium.contents = ''
 		if 'text' != medium.category:
@@ -1003,8 +1589,12 @@ class MediaFrontend(Media):
 		else:
 			protection_path = 'nonprotected'
 		medium_path = os.path.join(
-			self.config['media_path'],
-			protection_path,
+			self.medium_directory(
+				'media_path',
+				protection_path,
+				medium,
+				self.medium_shard_depth(medium),
+			),
 			medium.id + '.' + mime_to_extension(medium.mime),
 		)
 		if (
@@ -1055,66 +1645,133 @@ class MediaFrontend(Media):
 				'with_statuses': MediumStatus.ALLOWED,
 				'without_protections': MediumProtection.PRIVATE,
 			}
-		escape = lambda value: (
-			value
-				.replace('\\', '\\\\')
-				.replace('_', '\_')
-				.replace('%', '\%')
-				.replace('-', '\-')
-		)
 		medium.sets = {}
-		set_media = []
-		if 'sets' in medium.semantic_tags:
-			for set in medium.semantic_tags['sets']:
-				filter = default_filter.copy()
-				filter['with_tags_like'] = escape('set:' + set)
-				# get all media in plain set
-				medium.sets[set] = self.search_media(
-					filter=filter,
-					sort='creation_time',
-					order='asc',
-				)
-				filter['with_tags_like'] = escape('set:' + set + ':') + '%'
-				# get all media in ordered set
-				ordered_set = self.search_media(
-					filter=filter,
-					sort='creation_time',
-					order='asc',
-				)
-				for set_medium in ordered_set.values():
-					medium.sets[set].add(set_medium)
-				# add to collected set media
-				for set_medium in medium.sets[set].values():
-					if set_medium not in set_media:
-						set_media.append(set_medium)
+		if 'sets' not in medium.semantic_tags:
+			return
+		set_member_ids = {}
+		window_member_ids = set()
+		for set_name in medium.semantic_tags['sets']:
+			if set_name in set_member_ids:
+				continue
+			member_ids = self.get_set_member_ids(set_name)
+			if medium.id_bytes not in member_ids:
+				# sets tagged before the index existed are indexed on first view
+				self.index_set_members(set_name)
+				member_ids = self.get_set_member_ids(set_name)
+			# huge sets only show the members around the current medium
+			maximum = self.config['maximum_set_members']
+			if maximum < len(member_ids):
+				start = 0
+				if medium.id_bytes in member_ids:
+					start = member_ids.index(medium.id_bytes) - maximum // 2
+				start = max(0, min(start, len(member_ids) - maximum))
+				member_ids = member_ids[start:start + maximum]
+			set_member_ids[set_name] = member_ids
+			window_member_ids.update(member_ids)
+		if not window_member_ids:
+			return
+		# one fetch for the members of every set of this medium
+		filter = default_filter.copy()
+		filter['ids'] = list(window_member_ids)
+		set_media = self.search_media(filter=filter, perpage=len(window_member_ids))
 		self.populate_media_covers(set_media)
 		set_medium_ids_to_media = {}
-		for set_medium in set_media:
-			set_medium_ids_to_media[set_medium.id] = set_medium
-		for set in medium.sets:
-			weighted_set_medium_ids = {}
-			set_medium_ids = []
-			for set_medium in medium.sets[set].values():
-				weighted = False
-				for tag in set_medium.tags:
-					weight_start_pos = len(set) + 5
-					if 'set:' + set + ':' == tag[:weight_start_pos]:
-						weight = tag[weight_start_pos:]
-						while weight in weighted_set_medium_ids:
-							weight = weight + 'a'
-						weighted_set_medium_ids[weight] = set_medium.id
-				if not weighted:
-					set_medium_ids.append(set_medium.id)
-			ordered_set_medium_ids = []
-			sorted_keys = sorted(weighted_set_medium_ids.keys())
-			for key in sorted_keys:
-				ordered_set_medium_ids.append(weighted_set_medium_ids[key])
-			ordered_set_medium_ids += set_medium_ids
-			medium.sets[set] = []
-			for set_medium_id in ordered_set_medium_ids:
-				set_medium = set_medium_ids_to_media[set_medium_id]
-				if set_medium not in medium.sets[set]:
-					medium.sets[set].append(set_medium_ids_to_media[set_medium_id])
+		for set_medium in set_media.values():
+			set_medium_ids_to_media[set_medium.id_bytes] = set_medium
+		for set_name, member_ids in set_member_ids.items():
+			medium.sets[set_name] = [
+				set_medium_ids_to_media[member_id]
+				for member_id in member_ids
+				if member_id in set_medium_ids_to_media
+			]
+
+	def load_medium_ids(self, filter):
+		# pages by upload time rather than offset so every page is a range
+		# scan, overlapping at page boundaries so equal upload times aren't lost
+		filter = filter.copy()
+		ids = set()
+		while True:
+			media = list(
+				super().search_media(
+					filter=filter,
+					sort='upload_time',
+					order='asc',
+					perpage=1000,
+				).values()
+			)
+			loaded = len(ids)
+			for medium in media:
+				ids.add(medium.id_bytes)
+			if 1000 > len(media) or loaded == len(ids):
+				break
+			last_upload_time = media[-1].upload_time
+			for medium in reversed(media):
+				if medium.upload_time != last_upload_time:
+					last_upload_time = medium.upload_time
+					break
+			filter['uploaded_after'] = last_upload_time
+		return ids
+
+	def get_known_medium_ids(self):
+		# the lock only guards the shared state, other requests don't wait on
+		# a load in progress and check the database directly until it's done
+		with known_medium_ids_lock:
+			known = known_medium_ids.get(self.config['db_prefix'])
+			if not known:
+				known = {
+					'ids': set(),
+					'complete': False,
+					'loading': False,
+					'load_time': 0,
+				}
+				known_medium_ids[self.config['db_prefix']] = known
+			if known['loading'] or (
+					time.time() - known['load_time']
+					< self.config['known_medium_ids_refresh_period']
+				):
+				if not known['complete']:
+					return None
+				return known['ids']
+			known['loading'] = True
+		load_time = time.time()
+		filter = {}
+		if known['complete']:
+			# refreshes only pick up other processes' uploads, overlapping the
+			# previous refresh for uploads committed late. ids removed elsewhere
+			# stay until restart which only costs a database check for them
+			filter['uploaded_after'] = (
+				known['load_time']
+				- self.config['known_medium_ids_refresh_period']
+			)
+		try:
+			ids = self.load_medium_ids(filter)
+		finally:
+			with known_medium_ids_lock:
+				known['loading'] = False
+		with known_medium_ids_lock:
+			# media created by this process during the load are already in ids
+			known['ids'].update(ids)
+			known['complete'] = True
+			known['load_time'] = load_time
+			return known['ids']
+
+	def find_existing_media(self, medium_ids):
+		# answer misses from memory and only query the database for hits
+		known_ids = self.get_known_medium_ids()
+		if None == known_ids:
+			candidate_ids = list(set(medium_ids))
+		else:
+			candidate_ids = list(set(medium_ids) & known_ids)
+		existing = {}
+		if not candidate_ids:
+			return existing
+		media = super().search_media(
+			filter={'ids': candidate_ids},
+			perpage=len(candidate_ids),
+		)
+		for medium in media.values():
+			existing[medium.id_bytes] = medium
+		return existing
 
 	def get_contributors(self):
 		contributors = []
@@ -1168,12 +1825,7 @@ class MediaFrontend(Media):
 		def filter_tags(tags, remove_clutter=False, remove_nonclutter=False):
 			filtered_tags = []
 			for tag in tags:
-				clutter_tag = False
-				for clutter_tag_prefix in self.config['clutter_tag_prefixes']:
-					if clutter_tag_prefix == tag[:len(clutter_tag_prefix)]:
-						clutter_tag = True
-						break
-				if clutter_tag:
+				if self.is_clutter_tag(tag):
 					if remove_clutter:
 						continue
 				elif remove_nonclutter:
@@ -1292,48 +1944,305 @@ class MediaFrontend(Media):
 			)
 		return tag_suggestion_lists
 
-	def create_temp_medium_file(self, file_contents):
-		file_path = os.path.join(self.config['temp_path'], 'temp_medium_' + str(uuid.uuid4()))
-		f = open(file_path, 'w+b')
-		f.write(file_contents)
-		f.close()
-		return file_path
+	def ingest_medium_stream(self, stream):
+		# copy to a temp file in chunks while hashing and sniffing the mimetype
+		# so peak memory doesn't depend on file size and oversized or
+		# disallowed files are rejected as soon as that's known
+		errors = []
+		file_path = os.path.join(
+			self.config['temp_path'],
+			'temp_medium_' + str(uuid.uuid4()),
+		)
+		hash_algo = hashlib.md5()
+		size = 0
+		mime = ''
+		head = b''
+		try:
+			with open(file_path, 'w+b') as f:
+				for chunk in iter(lambda: stream.read(upload_chunk_size), b''):
+					size += len(chunk)
+					if self.config['maximum_upload_filesize'] < size:
+						errors.append('File greater than maximum upload filesize')
+						break
+					if not mime:
+						head += chunk
+						if mime_sniff_size <= len(head):
+							mime = get_buffer_mime(head)
+							head = b''
+							if mime in self.config['disallowed_mimetypes']:
+								errors.append('Mimetype not allowed')
+								break
+					hash_algo.update(chunk)
+					f.write(chunk)
+		except RemoteFileError as e:
+			errors.append(str(e))
+		except (ValueError, OSError, http.client.HTTPException):
+			errors.append('Problem uploading file')
+		if not errors and not mime:
+			mime = get_buffer_mime(head)
+			if mime in self.config['disallowed_mimetypes']:
+				errors.append('Mimetype not allowed')
+		if errors:
+			if os.path.exists(file_path):
+				os.remove(file_path)
+			return errors, '', None, '', 0
+		return errors, file_path, hash_algo.digest(), mime, size
+
+	def get_remote_fetcher(self):
+		# batch fetches ask for the fetcher from several threads at once
+		with self.remote_fetcher_lock:
+			if not self.remote_fetcher:
+				self.remote_fetcher = RemoteFetcher(
+					connect_timeout=self.config['remote_fetch_connect_timeout'],
+					read_timeout=self.config['remote_fetch_read_timeout'],
+					maximum_size=self.config['maximum_upload_filesize'],
+				)
+			return self.remote_fetcher
+
+	def close_remote_fetcher(self):
+		# idle keep-alive connections don't outlive the uploads using them
+		with self.remote_fetcher_lock:
+			if self.remote_fetcher:
+				self.remote_fetcher.close()
+				self.remote_fetcher = None
 
-	def place_medium_file(self, medium, source_file_path=None):
-		medium_file = medium.id + '.' + mime_to_extension(medium.mime)
+	def fetch_remote_medium(self, file_uri):
+		filename = file_uri.replace('\\', '/').split('/').pop()
+		try:
+			errors, file_path, id, mime, size = self.get_remote_fetcher().fetch(
+				file_uri,
+				self.ingest_medium_stream,
+			)
+		except ValueError as e:
+			return [str(e)], filename, '', None, '', 0
+		return errors, filename, file_path, id, mime, size
+
+	def fetch_remote_medium_async(self, file_uri):
+		# download off the calling thread, pass the returned future
+		# to upload as remote_fetch to wait for it and create the medium
+		return get_remote_fetch_pool(
+			self.config['remote_fetch_threads']
+		).submit(self.fetch_remote_medium, file_uri)
+
+	def finish_upload_session(self, session_id, uploader_id):
+		session = self.upload_sessions.get(session_id)
+		if not session or uploader_id != session['owner_id']:
+			return ['Upload session not found'], '', '', None, '', 0
+		try:
+			file_path, id, size = self.upload_sessions.finish(session)
+		except ValueError as e:
+			return [str(e)], session['filename'], '', None, '', 0
+		with open(file_path, 'rb') as f:
+			mime = get_buffer_mime(f.read(mime_sniff_size))
+		if mime in self.config['disallowed_mimetypes']:
+			os.remove(file_path)
+			return ['Mimetype not allowed'], session['filename'], '', None, '', 0
+		return [], session['filename'], file_path, id, mime, size
 
-		protected_path = os.path.join(self.config['media_path'], 'protected')
-		nonprotected_path = os.path.join(self.config['media_path'], 'nonprotected')
+	def ingest_medium_upload(self, file_upload):
+		errors, file_path, id, mime, size = self.ingest_medium_stream(
+			file_upload.stream
+		)
+		return errors, file_upload.filename, file_path, id, mime, size
+
+	def upload_batch(
+			self,
+			uploader_remote_origin,
+			uploader_id,
+			file_uris=[],
+			file_uploads=[],
+		):
+		# copying and hashing run in the pool while media are created serially
+		# since the database connection can't be shared between threads
+		pool = get_remote_fetch_pool(self.config['remote_fetch_threads'])
+		ingests = []
+		for file_uri in file_uris:
+			filename = file_uri.replace('\\', '/').split('/').pop()
+			ingests.append(
+				(filename, pool.submit(self.fetch_remote_medium, file_uri))
+			)
+		for file_upload in file_uploads:
+			ingests.append(
+				(
+					file_upload.filename,
+					pool.submit(self.ingest_medium_upload, file_upload),
+				)
+			)
+		results = []
+		try:
+			for filename, ingest in ingests:
+				# one file's unexpected ingest failure only fails that file
+				if ingest.exception():
+					results.append((['Problem uploading file'], filename, None))
+					continue
+				results.append(
+					self.upload(
+						uploader_remote_origin,
+						uploader_id,
+						remote_fetch=ingest,
+					)
+				)
+		finally:
+			self.close_remote_fetcher()
+		return results
+
+	def manifest_layout_current(self, manifest):
+		return (
+			self.config['shard_depth'] == manifest_shard_depth(manifest)
+			and self.config['link_public_files'] == manifest_linked(manifest)
+		)
 
+	def medium_protection_path(self, medium):
 		if (
 				MediumProtection.NONE != medium.protection
 				or MediumStatus.ALLOWED != medium.status
 			):
-			source_path = nonprotected_path
-			destination_path = protected_path
-		else:
-			source_path = protected_path
-			destination_path = nonprotected_path
+			return 'protected'
+		return 'nonprotected'
+
+	def medium_storage_path(self, medium):
+		# with linked public files every file is stored once in the protected
+		# tree so protection changes only add or remove links
+		if self.config['link_public_files']:
+			return 'protected'
+		return self.medium_protection_path(medium)
+
+	def medium_shard_depth(self, medium):
+		# media keep the layout recorded in their manifest until migrated
+		depth = manifest_shard_depth(medium.manifest)
+		if None == depth:
+			# media without a manifest yet are wherever their original is found
+			depth = self.find_medium_shard_depth(medium)
+		if None == depth:
+			return self.config['shard_depth']
+		return depth
+
+	def shard_depths(self, medium):
+		# every layout a medium's files might be found in
+		depths = [self.config['shard_depth']]
+		for depth in [manifest_shard_depth(medium.manifest), 0]:
+			if None != depth and depth not in depths:
+				depths.append(depth)
+		return depths
+
+	def medium_directory(self, root, protection_path, medium, depth=None):
+		if None == depth:
+			depth = self.config['shard_depth']
+		return os.path.join(
+			self.config[root],
+			protection_path,
+			*shard_parts(medium.id, depth),
+		)
+
+	def find_medium_shard_depth(
+			self,
+			medium,
+			protection_paths=['protected', 'nonprotected'],
+		):
+		medium_file = medium.id + '.' + mime_to_extension(medium.mime)
+		for depth in self.shard_depths(medium):
+			for protection_path in protection_paths:
+				if os.path.exists(
+						os.path.join(
+							self.medium_directory(
+								'media_path',
+								protection_path,
+								medium,
+								depth,
+							),
+							medium_file,
+						)
+					):
+					return depth
+		return None
+
+	def find_medium_directory(self, root, protection_path, medium, filename):
+		for depth in self.shard_depths(medium):
+			directory = self.medium_directory(root, protection_path, medium, depth)
+			if os.path.exists(os.path.join(directory, filename)):
+				return directory
+		return ''
+
+	def place_medium_file(self, medium, source_file_path=None):
+		medium_file = medium.id + '.' + mime_to_extension(medium.mime)
+
+		destination_path = self.medium_directory(
+			'media_path',
+			self.medium_storage_path(medium),
+			medium,
+		)
+		destination = os.path.join(destination_path, medium_file)
+		link_path = os.path.join(
+			self.medium_directory('media_path', 'nonprotected', medium),
+			medium_file,
+		)
 
 		if source_file_path:
-			source = source_file_path
+			sources = [source_file_path]
 		else:
-			source = os.path.join(source_path, medium_file)
+			# the other protection path or a previous layout
+			sources = []
+			for depth in self.shard_depths(medium):
+				for protection_path in ['protected', 'nonprotected']:
+					sources.append(
+						os.path.join(
+							self.medium_directory(
+								'media_path',
+								protection_path,
+								medium,
+								depth,
+							),
+							medium_file,
+						)
+					)
+
+		for source in sources:
+			if os.path.islink(source):
+				# links left from a previous layout or storage mode
+				if (
+						source != link_path
+						or not self.config['link_public_files']
+					):
+					os.remove(source)
+				continue
+			if source != destination and os.path.exists(source):
+				os.makedirs(destination_path, exist_ok=True)
+				move(source, destination)
+				if source_file_path:
+					self.set_file_manifest(
+						medium.id_bytes,
+						manifest_with_layout(
+							{'original'},
+							self.config['shard_depth'],
+							self.config['link_public_files'],
+						),
+					)
+				break
 
-		if os.path.exists(source):
-			move(source, os.path.join(destination_path, medium_file))
+		if self.config['link_public_files'] and os.path.exists(destination):
+			link_public_file(
+				destination,
+				link_path,
+				'nonprotected' == self.medium_protection_path(medium),
+			)
 
 	def delete_medium_file(self, medium):
 		medium_file = medium.id + '.' + mime_to_extension(medium.mime)
 
-		for protection_path in ['protected', 'nonprotected']:
-			file_path = os.path.join(
-				self.config['media_path'],
-				protection_path,
-				medium_file,
-			)
-			if os.path.exists(file_path):
-				os.remove(file_path)
+		for depth in self.shard_depths(medium):
+			for protection_path in ['protected', 'nonprotected']:
+				file_path = os.path.join(
+					self.medium_directory(
+						'media_path',
+						protection_path,
+						medium,
+						depth,
+					),
+					medium_file,
+				)
+				if os.path.lexists(file_path):
+					os.remove(file_path)
+		self.remove_file_manifest_entries(medium.id_bytes, ['original'])
 		subject_id = ''
 		if self.accounts.current_user:
 			subject_id = self.accounts.current_user.id_bytes
@@ -1344,67 +2253,77 @@ class MediaFrontend(Media):
 		)
 
 	def iterate_medium_summaries(self, medium, cb):
-		for protection_path in ['protected', 'nonprotected']:
-			for edge in self.config['summary_edges']:
-				summary_path = os.path.join(
-					self.config['summaries_path'],
-					protection_path
-				)
-				summary_file_template = medium.id + '.' + str(edge) + '.'
-
-				extensions = []
-				if 'image' == medium.category:
-					# static, fallback, reencode
-					extensions = ['webp', 'png', 'gif']
-				elif 'video' == medium.category:
-					# static, fallback
-					extensions = ['webp', 'png']
-				elif medium.category in ['audio', 'archive']:
-					# static, fallback
-					extensions = ['webp', 'png']
-
-				for extension in extensions:
-					summary_file =  summary_file_template + extension
-					if os.path.exists(os.path.join(summary_path, summary_file)):
-						cb(summary_path, summary_file)
-			if 'video' == medium.category:
+		extensions = []
+		if 'image' == medium.category:
+			# static, fallback, reencode
+			extensions = ['webp', 'png', 'gif']
+		elif 'video' == medium.category:
+			# static, fallback
+			extensions = ['webp', 'png']
+		elif medium.category in ['audio', 'archive']:
+			# static, fallback
+			extensions = ['webp', 'png']
+		summary_files = []
+		for edge in self.config['summary_edges']:
+			for extension in extensions:
+				summary_files.append(medium.id + '.' + str(edge) + '.' + extension)
+		if 'video' == medium.category:
+			extensions = [
 				# clip
-				extensions.append('clip.webm')
+				'clip.webm',
 				# slideshow strips
-				extensions = ['slideshow.webp', 'slideshow.png']
-				# reencode
-				if not is_websafe_video(medium.mime):
-					extensions.append('reencoded.webm')
-				for extension in extensions:
-					summary_file = medium.id + '.' + extension
-					if os.path.exists(os.path.join(summary_path, summary_file)):
+				'slideshow.webp',
+				'slideshow.png',
+			]
+			# reencode
+			if not is_websafe_video(medium.mime):
+				extensions.append('reencoded.webm')
+			for extension in extensions:
+				summary_files.append(medium.id + '.' + extension)
+
+		for depth in self.shard_depths(medium):
+			for protection_path in ['protected', 'nonprotected']:
+				summary_path = self.medium_directory(
+					'summaries_path',
+					protection_path,
+					medium,
+					depth,
+				)
+				for summary_file in summary_files:
+					if os.path.lexists(os.path.join(summary_path, summary_file)):
 						cb(summary_path, summary_file)
 
 	def place_medium_summaries(self, medium):
-		protected_path = os.path.join(self.config['summaries_path'], 'protected')
-		nonprotected_path = os.path.join(
-			self.config['summaries_path'],
-			'nonprotected',
+		destination_path = self.medium_directory(
+			'summaries_path',
+			self.medium_storage_path(medium),
+			medium,
 		)
-		if (
-				MediumProtection.NONE != medium.protection
-				or MediumStatus.ALLOWED != medium.status
-			):
-			source_path = nonprotected_path
-			destination_path = protected_path
-		else:
-			source_path = protected_path
-			destination_path = nonprotected_path
+		link_path = self.medium_directory('summaries_path', 'nonprotected', medium)
+		public = 'nonprotected' == self.medium_protection_path(medium)
 
-		self.iterate_medium_summaries(
-			medium,
-			lambda summary_path, summary_file: (
-				move(
-					os.path.join(summary_path, summary_file),
-					os.path.join(destination_path, summary_file)
-				)
-			)
-		)
+		def place_summary(summary_path, summary_file):
+			source = os.path.join(summary_path, summary_file)
+			if os.path.islink(source):
+				# links left from a previous layout or storage mode
+				if (
+						summary_path != link_path
+						or not self.config['link_public_files']
+						or not public
+					):
+					os.remove(source)
+				return
+			if summary_path != destination_path:
+				os.makedirs(destination_path, exist_ok=True)
+				move(source, os.path.join(destination_path, summary_file))
+			if self.config['link_public_files']:
+				link_public_file(
+					os.path.join(destination_path, summary_file),
+					os.path.join(link_path, summary_file),
+					public,
+				)
+
+		self.iterate_medium_summaries(medium, place_summary)
 
 	def delete_medium_summaries(self, medium):
 		self.iterate_medium_summaries(
@@ -1413,6 +2332,16 @@ class MediaFrontend(Media):
 				os.remove(os.path.join(summary_path, summary_file))
 			)
 		)
+		manifest = self.get_file_manifests([medium.id_bytes]).get(medium.id_bytes)
+		if manifest:
+			self.set_file_manifest(
+				medium.id_bytes,
+				manifest_with_layout(
+					manifest & {'original'},
+					manifest_shard_depth(manifest),
+					manifest_linked(manifest),
+				),
+			)
 		subject_id = ''
 		if self.accounts.current_user:
 			subject_id = self.accounts.current_user.id_bytes
@@ -1422,29 +2351,338 @@ class MediaFrontend(Media):
 			object_id=medium.id_bytes,
 		)
 
-	def summaries_from_image(self, image, summary_path):
-		full_width, full_height = image.size
-		for edge in self.config['summary_edges']:
-			thumbnail_edge = edge
-			# for non-square images ensure shortest edge dimension is thumbnail edge
-			# which means feeding .thumbnail() a calculated longest edge dimension
-			# which will scale the shortest edge to the desired value
-			if full_width < full_height:
-				thumbnail_edge = full_height * (edge / full_width)
-			elif full_width > full_height:
-				thumbnail_edge = full_width * (edge / full_height)
-			thumbnail = image.copy()
-			#TODO maybe allow config to switch between
-			#TODO NEAREST/BILINEAR/BICUBIC/LANCZOS for thumbnail resample?
-			thumbnail.thumbnail((thumbnail_edge, thumbnail_edge), Image.BICUBIC)
+	def prepare_summary_image(self, image):
+		largest_edge = max(self.config['summary_edges'])
+		if 'JPEG' == image.format:
+			# decode with reduced dct scaling straight to near the largest edge
+			image.draft(
+				image.mode,
+				summary_thumbnail_size(image.width, image.height, largest_edge),
+			)
+		image = summary_source_image(image)
+		return reduce_to_pixel_budget(
+			image,
+			largest_edge,
+			self.config['summary_pixel_budget'],
+		)
 
+	def summaries_from_image(self, image, summary_path):
+		image = summary_source_image(image)
+
+		# derive each smaller edge from the previous result
+		# instead of resizing from the original every time
+		thumbnails = []
+		source = image
+		for edge in sorted(self.config['summary_edges'], reverse=True):
+			size = summary_thumbnail_size(source.width, source.height, edge)
+			thumbnail = source
+			if size != source.size:
+				#TODO maybe allow config to switch between
+				#TODO NEAREST/BILINEAR/BICUBIC/LANCZOS for thumbnail resample?
+				thumbnail = source.resize(size, Image.BICUBIC, reducing_gap=2.0)
+			thumbnails.append((edge, thumbnail))
+			source = thumbnail
+
+		tasks = []
+		for edge, thumbnail in thumbnails:
 			# static
-			thumbnail_path = summary_path.format(str(edge) + '.webp')
-			thumbnail.save(thumbnail_path, 'WebP', quality=90)
-
+			tasks.append((thumbnail, 'WebP', summary_path.format(str(edge) + '.webp')))
 			# fallback
-			thumbnail_path = summary_path.format(str(edge) + '.png')
-			thumbnail.save(thumbnail_path, 'PNG', optimize=True)
+			tasks.append((thumbnail, 'PNG', summary_path.format(str(edge) + '.png')))
+
+		processes = self.config['summary_encode_processes']
+		if 1 < processes:
+			# share each decoded thumbnail with the encode processes
+			# instead of pickling a copy of it into every task
+			shms = {}
+			try:
+				for edge, thumbnail in thumbnails:
+					if id(thumbnail) in shms:
+						continue
+					data = thumbnail.tobytes()
+					shm = shared_memory.SharedMemory(
+						create=True,
+						size=max(1, len(data)),
+					)
+					shms[id(thumbnail)] = shm
+					shm.buf[:len(data)] = data
+					del data
+				pool = get_summary_encode_pool(processes)
+				futures = []
+				for thumbnail, format, output_path in tasks:
+					futures.append(
+						pool.submit(
+							save_shared_summary,
+							shms[id(thumbnail)].name,
+							thumbnail.mode,
+							thumbnail.size,
+							format,
+							output_path,
+						)
+					)
+				for future in futures:
+					future.result()
+				return
+			except BrokenProcessPool:
+				# discard the broken pool and fall back to encoding in-process
+				del summary_encode_pools[processes]
+			finally:
+				for shm in shms.values():
+					shm.close()
+					shm.unlink()
+
+		for thumbnail, format, output_path in tasks:
+			save_summary(thumbnail, format, output_path)
+
+	def ffmpeg_thread_args(self):
+		if (
+				self.config['ffmpeg_thread_limit']
+				and isinstance(self.config['ffmpeg_thread_limit'], int)
+				and 0 < self.config['ffmpeg_thread_limit']
+			):
+			return ['-threads', str(self.config['ffmpeg_thread_limit'])]
+		return []
+
+	def video_clip_range(self, duration_ms):
+		if 0 >= self.config['video_clip_duration_ms']:
+			return 0, 0
+		if duration_ms <= self.config['video_clip_duration_ms']:
+			return 0, duration_ms
+		midpoint_ms = duration_ms / 2
+		half_video_clip_duration_ms = self.config['video_clip_duration_ms'] / 2
+		start_ms = midpoint_ms - half_video_clip_duration_ms
+		return start_ms, start_ms + self.config['video_clip_duration_ms']
+
+	def encode_video_summaries(
+			self,
+			file_path,
+			summary_path,
+			duration_s,
+			snapshot=True,
+			clip_start_ms=0,
+			clip_end_ms=0,
+			reencode=False,
+		):
+		snapshot_path = ''
+		if snapshot:
+			snapshot_path = os.path.join(
+				self.config['temp_path'],
+				'temp_snapshot_' + str(uuid.uuid4()) + '.png',
+			)
+		# same first snapshot position as generate_video_snapshots
+		snapshot_s = math.floor(duration_s) / (self.config['video_snapshots'] + 2)
+		clip = (
+			0 < clip_end_ms
+			and clip_start_ms < clip_end_ms
+			and 0 <= self.config['video_clip_edge']
+		)
+		reencode = reencode and 0 <= self.config['video_reencode_edge']
+		if not snapshot and not clip and not reencode:
+			return snapshot_path
+
+		# without a full reencode only decode from the earliest point needed
+		seek_s = 0
+		if not reencode:
+			seek_points = []
+			if snapshot:
+				seek_points.append(snapshot_s)
+			if clip:
+				seek_points.append(clip_start_ms / 1000)
+			seek_s = min(seek_points)
+
+		# scale the shortest edge to the target edge without knowing dimensions
+		scale = lambda edge: (
+			'scale=w=\'if(lt(iw,ih),-1,' + str(edge) + ')\''
+				+ ':h=\'if(lt(iw,ih),' + str(edge) + ',-1)\''
+		)
+		vp8_args = [
+			'-vcodec',
+			'libvpx',
+			'-quality',
+			'good',
+			'-cpu-used',
+			'5',
+		]
+
+		labels = []
+		if snapshot:
+			labels.append('snapshot')
+		if clip:
+			labels.append('clip')
+		if reencode:
+			labels.append('reencoded')
+		graph = [
+			'[0:v]split=' + str(len(labels))
+				+ ''.join(['[' + label + '_in]' for label in labels])
+		]
+		if snapshot:
+			graph.append(
+				'[snapshot_in]trim=start=' + str(snapshot_s - seek_s)
+					+ ',setpts=PTS-STARTPTS[snapshot]'
+			)
+		if clip:
+			graph.append(
+				'[clip_in]trim=start=' + str(clip_start_ms / 1000 - seek_s)
+					+ ':end=' + str(clip_end_ms / 1000 - seek_s)
+					+ ',setpts=PTS-STARTPTS,'
+					+ scale(self.config['video_clip_edge'])
+					+ '[clip]'
+			)
+		if reencode:
+			graph.append(
+				'[reencoded_in]'
+					+ scale(self.config['video_reencode_edge'])
+					+ '[reencoded]'
+			)
+
+		ffmpeg_call = [
+			self.config['ffmpeg_path'],
+			'-y',
+		]
+		if seek_s:
+			ffmpeg_call += [
+				'-ss',
+				str(seek_s),
+			]
+		ffmpeg_call += [
+			'-i',
+			file_path,
+			'-filter_complex',
+			';'.join(graph),
+		]
+		if snapshot:
+			ffmpeg_call += [
+				'-map',
+				'[snapshot]',
+				'-frames:v',
+				'1',
+				'-update',
+				'1',
+			]
+			ffmpeg_call += self.ffmpeg_thread_args()
+			ffmpeg_call += [
+				snapshot_path,
+			]
+		if clip:
+			ffmpeg_call += [
+				'-map',
+				'[clip]',
+				'-an',
+			]
+			ffmpeg_call += vp8_args + self.ffmpeg_thread_args()
+			ffmpeg_call += [
+				summary_path.format('clip.webm'),
+			]
+		if reencode:
+			ffmpeg_call += [
+				'-map',
+				'[reencoded]',
+				'-map',
+				'0:a?',
+			]
+			ffmpeg_call += vp8_args + self.ffmpeg_thread_args()
+			ffmpeg_call += [
+				summary_path.format('reencoded.webm'),
+			]
+		subprocess.run(ffmpeg_call)
+		return snapshot_path
+
+	def animated_summaries_from_gif(self, file_path, summary_path, width, height):
+		# one decode split into a scaled and re-paletted branch per edge
+		portrait = (width < height)
+		edges = self.config['summary_edges']
+		graph = [
+			'[0:v]split=' + str(len(edges))
+				+ ''.join(['[edge' + str(i) + ']' for i in range(len(edges))])
+		]
+		for i, edge in enumerate(edges):
+			if portrait:
+				scale_width = -1
+				scale_height = min(edge, height)
+			else:
+				scale_width = min(edge, width)
+				scale_height = -1
+			branch = str(i)
+			graph.append(
+				'[edge' + branch + ']scale=' + str(scale_width) + ':' + str(scale_height)
+					+ ',split[frames' + branch + '][palette_source' + branch + ']'
+			)
+			graph.append(
+				'[palette_source' + branch + ']palettegen[palette' + branch + ']'
+			)
+			graph.append(
+				'[frames' + branch + '][palette' + branch + ']paletteuse[gif' + branch + ']'
+			)
+
+		ffmpeg_call = [
+			self.config['ffmpeg_path'],
+			'-y',
+			'-i',
+			file_path,
+			'-filter_complex',
+			';'.join(graph),
+		]
+		for i, edge in enumerate(edges):
+			ffmpeg_call += [
+				'-map',
+				'[gif' + str(i) + ']',
+			]
+			ffmpeg_call += self.ffmpeg_thread_args()
+			ffmpeg_call += [
+				summary_path.format(str(edge) + '.gif'),
+			]
+		subprocess.run(ffmpeg_call)
+
+	def generate_video_slideshow(self, file_path, summary_path, duration_s):
+		snapshots = self.config['video_snapshots']
+		if 1 > snapshots:
+			return
+		strip_path = os.path.join(
+			self.config['temp_path'],
+			'temp_slideshow_' + str(uuid.uuid4()) + '.png',
+		)
+		# space the snapshot intervals out with the intention to skip first and last
+		interval_s = math.floor(duration_s) / (snapshots + 2)
+		edge = str(self.config['video_slideshow_edge'])
+
+		# decode keyframes only and keep the first keyframe
+		# at or after each interval, then tile them into one strip
+		ffmpeg_call = [
+			self.config['ffmpeg_path'],
+			'-y',
+			'-skip_frame',
+			'nokey',
+			'-i',
+			file_path,
+			'-vf',
+			'select=\'gte(t,' + str(interval_s) + ')'
+				+ '*(isnan(prev_selected_t)'
+				+ '+gte(t-prev_selected_t,' + str(interval_s) + '))\','
+				+ 'scale=w=\'if(lt(iw,ih),-1,' + edge + ')\''
+				+ ':h=\'if(lt(iw,ih),' + edge + ',-1)\','
+				+ 'tile=' + str(snapshots) + 'x1',
+			'-an',
+			'-frames:v',
+			'1',
+			'-update',
+			'1',
+		]
+		ffmpeg_call += self.ffmpeg_thread_args()
+		ffmpeg_call += [
+			strip_path,
+		]
+		subprocess.run(ffmpeg_call)
+
+		if not os.path.exists(strip_path):
+			return
+		strip = Image.open(strip_path)
+		strip = summary_source_image(strip)
+		# static
+		save_summary(strip, 'WebP', summary_path.format('slideshow.webp'))
+		# fallback
+		save_summary(strip, 'PNG', summary_path.format('slideshow.png'))
+		strip.close()
+		os.remove(strip_path)
 
 	def generate_video_snapshots(self, file_path, duration_s):
 		# space the snapshot intervals out with the intention to skip first and last
@@ -1484,8 +2722,8 @@ class MediaFrontend(Media):
 			snapshots.append((snapshot_path, snapshot))
 
 			if 1 == i:
-				#TODO for now only generate the one static summary
-				#TODO maybe do slideshow later
+				# only the static summary snapshot is needed here
+				# since generate_video_slideshow builds the slideshow strip
 				break
 		return snapshots
 
@@ -1568,6 +2806,62 @@ class MediaFrontend(Media):
 		]
 		subprocess.run(ffmpeg_call)
 
+	def run_ffprobe(self, args):
+		try:
+			result = subprocess.run(
+				[
+					self.config['ffprobe_path'],
+					'-v',
+					'quiet',
+					'-print_format',
+					'json',
+				] + args,
+				stdout=subprocess.PIPE,
+				stderr=subprocess.DEVNULL,
+				timeout=self.config['ffprobe_timeout'],
+			)
+		except subprocess.TimeoutExpired:
+			return {}
+		try:
+			return json.loads(result.stdout)
+		except ValueError:
+			return {}
+
+	def probe_last_packet_time(self, file_path):
+		# stream packet timestamps line by line keeping only the latest
+		# so memory stays constant no matter how many packets there are
+		process = subprocess.Popen(
+			[
+				self.config['ffprobe_path'],
+				'-v',
+				'quiet',
+				'-show_entries',
+				'packet=dts_time,pts_time',
+				'-of',
+				'csv=p=0',
+				'-i',
+				file_path,
+			],
+			stdout=subprocess.PIPE,
+			stderr=subprocess.DEVNULL,
+			universal_newlines=True,
+		)
+		timer = threading.Timer(self.config['ffprobe_timeout'], process.kill)
+		timer.start()
+		last_time_s = 0
+		try:
+			for line in process.stdout:
+				for value in line.strip().split(','):
+					try:
+						last_time_s = max(last_time_s, float(value))
+					except ValueError:
+						continue
+		finally:
+			timer.cancel()
+			process.stdout.close()
+			process.wait()
+		return last_time_s
+
 	def get_video_info(self, file_path):
 		width = 0
 		height = 0
@@ -1575,17 +2869,12 @@ class MediaFrontend(Media):
 		audio_codec = ''
 		video_codec = ''
 
-		probe_json = subprocess.getoutput(' '.join([
-			self.config['ffprobe_path'],
-			'-v',
-			'quiet',
-			'-print_format',
-			'json',
+		probe = self.run_ffprobe([
 			'-show_streams',
+			'-show_format',
 			'-i',
 			file_path,
-		]))
-		probe = json.loads(probe_json)
+		])
 
 		if 'streams' in probe:
 			for stream in probe['streams']:
@@ -1606,25 +2895,20 @@ class MediaFrontend(Media):
 					elif 'video' == stream['codec_type']:
 						video_codec = codec_name
 
-		# missing duration after streams probe, do packets probe
-		if not duration_s:
-			probe_json = subprocess.getoutput(' '.join([
-				self.config['ffprobe_path'],
-				'-v',
-				'quiet',
-				'-print_format',
-				'json',
-				'-show_packets',
-				'-i',
-				file_path,
-			]))
-			probe = json.loads(probe_json)
+		# missing duration after streams probe, use container duration
+		if (
+				not duration_s
+				and 'format' in probe
+				and 'duration' in probe['format']
+			):
+			try:
+				duration_s = float(probe['format']['duration'])
+			except ValueError:
+				pass
 
-			last_frame = probe['packets'].pop()
-			if 'dts_time' in last_frame:
-				duration_s = float(last_frame['dts_time'])
-			elif 'pts_time' in last_frame:
-				duration_s = float(last_frame['pts_time'])
+		# still missing duration, do packets probe
+		if not duration_s:
+			duration_s = self.probe_last_packet_time(file_path)
 
 		# still missing duration after packets probe
 		if not duration_s:
@@ -1646,116 +2930,486 @@ class MediaFrontend(Media):
 
 		return width, height, duration_s, audio_codec, video_codec
 
+	def summary_signatures(self, medium):
+		# the config each group of summary artifacts was generated with
+		# so regeneration can skip groups whose config hasn't changed
+		signatures = {}
+		if 'image' == medium.category:
+			signatures['static'] = {
+				'edges': self.config['summary_edges'],
+			}
+			if 'image/gif' == medium.mime:
+				signatures['animated'] = {
+					'edges': self.config['summary_edges'],
+				}
+		elif 'video' == medium.category:
+			signatures['static'] = {
+				'edges': self.config['summary_edges'],
+				'snapshots': self.config['video_snapshots'],
+			}
+			signatures['slideshow'] = {
+				'snapshots': self.config['video_snapshots'],
+				'edge': self.config['video_slideshow_edge'],
+			}
+			signatures['clip'] = {
+				'edge': self.config['video_clip_edge'],
+				'duration_ms': self.config['video_clip_duration_ms'],
+			}
+			if not is_websafe_video(medium.mime):
+				signatures['reencode'] = {
+					'edge': self.config['video_reencode_edge'],
+				}
+		return signatures
+
+	def summary_group_files(self, medium, group, info):
+		# summary file suffixes each artifact group is expected to produce
+		files = []
+		if 'static' == group:
+			if 'video' == medium.category and not info.get('duration_s'):
+				return files
+			for edge in self.config['summary_edges']:
+				files.append(str(edge) + '.webp')
+				files.append(str(edge) + '.png')
+		elif 'animated' == group:
+			if 1 < info.get('frames', 0):
+				for edge in self.config['summary_edges']:
+					files.append(str(edge) + '.gif')
+		elif 'slideshow' == group:
+			if info.get('duration_s') and 0 < self.config['video_snapshots']:
+				files.append('slideshow.webp')
+				files.append('slideshow.png')
+		elif 'clip' == group:
+			if (
+					info.get('duration_s')
+					and 0 < self.config['video_clip_duration_ms']
+					and 0 <= self.config['video_clip_edge']
+				):
+				files.append('clip.webm')
+		elif 'reencode' == group:
+			if 0 <= self.config['video_reencode_edge']:
+				files.append('reencoded.webm')
+		return files
+
+	def get_summary_metadata(self, medium_id):
+		row = self.connection.execute(
+			self.summary_metadata.select().where(
+				self.summary_metadata.c.medium_id == medium_id
+			)
+		).fetchone()
+		if not row:
+			return {}, {}
+		return json.loads(row.info), json.loads(row.artifacts)
+
+	def set_summary_metadata(self, medium_id, info, artifacts):
+		self.delete_summary_metadata(medium_id)
+		self.connection.execute(
+			self.summary_metadata.insert().values(
+				medium_id=medium_id,
+				info=json.dumps(info),
+				artifacts=json.dumps(artifacts),
+			)
+		)
+
+	def delete_summary_metadata(self, medium_id):
+		self.connection.execute(
+			self.summary_metadata.delete().where(
+				self.summary_metadata.c.medium_id == medium_id
+			)
+		)
+
+	def get_file_manifests(self, medium_ids):
+		manifests = {}
+		if not medium_ids:
+			return manifests
+		rows = self.connection.execute(
+			self.file_manifests.select().where(
+				self.file_manifests.c.medium_id.in_(medium_ids)
+			)
+		).fetchall()
+		for row in rows:
+			manifests[row.medium_id] = set(row.files.split())
+		return manifests
+
+	def set_file_manifest(self, medium_id, files):
+		self.forget_media(medium_id)
+		self.delete_file_manifest(medium_id)
+		self.connection.execute(
+			self.file_manifests.insert().values(
+				medium_id=medium_id,
+				files=' '.join(sorted(files)),
+			)
+		)
+
+	def delete_file_manifest(self, medium_id):
+		self.connection.execute(
+			self.file_manifests.delete().where(
+				self.file_manifests.c.medium_id == medium_id
+			)
+		)
+
+	def remove_file_manifest_entries(self, medium_id, entries):
+		manifest = self.get_file_manifests([medium_id]).get(medium_id)
+		if None == manifest:
+			return
+		self.set_file_manifest(medium_id, manifest - set(entries))
+
+	def get_semantic_tags(self, medium_ids):
+		semantic_tags = {}
+		if not medium_ids:
+			return semantic_tags
+		rows = self.connection.execute(
+			self.semantic_tags.select().where(
+				self.semantic_tags.c.medium_id.in_(medium_ids)
+			)
+		).fetchall()
+		for row in rows:
+			semantic_tags[row.medium_id] = json.loads(row.semantic)
+		return semantic_tags
+
+	def set_semantic_tags(self, medium_id, semantic_tags):
+		self.delete_semantic_tags(medium_id)
+		self.connection.execute(
+			self.semantic_tags.insert().values(
+				medium_id=medium_id,
+				semantic=json.dumps(semantic_tags),
+			)
+		)
+
+	def delete_semantic_tags(self, medium_id):
+		self.connection.execute(
+			self.semantic_tags.delete().where(
+				self.semantic_tags.c.medium_id == medium_id
+			)
+		)
+
+	def get_set_member_ids(self, set_name):
+		rows = self.connection.execute(
+			self.set_members.select().where(
+				self.set_members.c.set_name == set_name
+			).order_by(
+				self.set_members.c.weight.is_(None).asc(),
+				self.set_members.c.weight.asc(),
+				self.set_members.c.creation_time.asc(),
+			)
+		).fetchall()
+		return [row.medium_id for row in rows]
+
+	def index_set_members(self, set_name):
+		escape = lambda value: (
+			value
+				.replace('\\', '\\\\')
+				.replace('_', '\_')
+				.replace('%', '\%')
+				.replace('-', '\-')
+		)
+		member_ids = set()
+		# plain and weighted members
+		for tag_like in [
+				escape('set:' + set_name),
+				escape('set:' + set_name + ':') + '%',
+			]:
+			member_ids.update(self.load_medium_ids({'with_tags_like': tag_like}))
+		if member_ids:
+			self.store_semantic_tags(list(member_ids))
+
+	def set_set_memberships(self, medium, memberships):
+		self.delete_set_memberships(medium.id_bytes)
+		if not memberships:
+			return
+		self.connection.execute(
+			self.set_members.insert(),
+			[
+				{
+					'set_name': set_name,
+					'medium_id': medium.id_bytes,
+					'weight': weight,
+					'creation_time': medium.creation_time,
+				}
+				for set_name, weight in memberships.items()
+			],
+		)
+
+	def delete_set_memberships(self, medium_id):
+		self.connection.execute(
+			self.set_members.delete().where(
+				self.set_members.c.medium_id == medium_id
+			)
+		)
+
+	def store_semantic_tags(self, medium_ids):
+		# reparse from the tags as written rather than the ones passed
+		if list != type(medium_ids):
+			medium_ids = [medium_ids]
+		for i in range(0, len(medium_ids), 1000):
+			chunk = medium_ids[i:i + 1000]
+			media = super().search_media(
+				filter={'ids': chunk},
+				perpage=len(chunk),
+			)
+			self.populate_media_tags(media)
+			for medium in media.values():
+				self.set_semantic_tags(
+					medium.id_bytes,
+					parse_semantic_tags(medium.tags),
+				)
+				self.set_set_memberships(medium, parse_set_memberships(medium.tags))
+
+	def store_media_semantic_tags(self, page=0, perpage=100):
+		# backfill semantic tags and set members for media tagged before
+		# they were stored
+		media = super().search_media(
+			filter={},
+			sort='upload_time',
+			order='asc',
+			page=page,
+			perpage=perpage,
+		)
+		self.populate_media_tags(media)
+		results = {'checked': 0, 'updated': 0}
+		stored = self.get_semantic_tags(
+			[medium.id_bytes for medium in media.values()]
+		)
+		for medium in media.values():
+			results['checked'] += 1
+			semantic_tags = parse_semantic_tags(medium.tags)
+			if semantic_tags != stored.get(medium.id_bytes):
+				self.set_semantic_tags(medium.id_bytes, semantic_tags)
+				results['updated'] += 1
+			self.set_set_memberships(medium, parse_set_memberships(medium.tags))
+		return results
+
+	def scan_medium_files(self, medium):
+		files = set()
+		# the layout is wherever the original is found
+		depth = self.find_medium_shard_depth(medium)
+		if None == depth:
+			depth = self.config['shard_depth']
+		else:
+			files.add('original')
+		# protected media are stored the same way in either storage mode
+		linked = self.config['link_public_files']
+		if 'nonprotected' == self.medium_protection_path(medium):
+			linked = os.path.islink(
+				os.path.join(
+					self.medium_directory('media_path', 'nonprotected', medium, depth),
+					medium.id + '.' + mime_to_extension(medium.mime),
+				)
+			)
+		self.iterate_medium_summaries(
+			medium,
+			lambda summary_path, summary_file: (
+				files.add(summary_file[len(medium.id) + 1:])
+			)
+		)
+		files = manifest_with_version(files, manifest_version(medium.manifest))
+		return manifest_with_layout(files, depth, linked)
+
+	def verify_media_manifests(self, page=0, perpage=100):
+		# reconcile manifests with the files actually on disk
+		media = self.search_media(
+			filter={},
+			sort='upload_time',
+			order='asc',
+			page=page,
+			perpage=perpage,
+		)
+		results = {'checked': 0, 'updated': 0}
+		for medium in media.values():
+			results['checked'] += 1
+			files = self.scan_medium_files(medium)
+			if files != medium.manifest:
+				self.set_file_manifest(medium.id_bytes, files)
+				results['updated'] += 1
+		return results
+
+	def migrate_media_layout(self, page=0, perpage=100):
+		# move files left in a previous layout into the configured one
+		# uris follow each medium's manifest so serving continues throughout
+		media = self.search_media(
+			filter={},
+			sort='upload_time',
+			order='asc',
+			page=page,
+			perpage=perpage,
+		)
+		results = {'checked': 0, 'migrated': 0}
+		for medium in media.values():
+			results['checked'] += 1
+			if self.manifest_layout_current(medium.manifest):
+				continue
+			self.place_medium_file(medium)
+			self.place_medium_summaries(medium)
+			self.set_file_manifest(medium.id_bytes, self.scan_medium_files(medium))
+			results['migrated'] += 1
+		return results
+
 	def generate_medium_summaries(self, medium):
-		self.delete_medium_summaries(medium)
+		# per-stage durations in seconds for the most recent generation
+		self.summary_timings = {}
+		generation_start = time.perf_counter()
 
-		protection_path = 'nonprotected'
-		if MediumProtection.NONE != medium.protection:
-			protection_path = 'protected'
+		protection_path = self.medium_storage_path(medium)
+
+		# summaries are written into the configured layout
+		# so move files left in a previous layout there first
+		if not self.manifest_layout_current(medium.manifest):
+			self.place_medium_file(medium)
+			self.place_medium_summaries(medium)
 
 		file_path = os.path.join(
-			self.config['media_path'],
-			protection_path,
+			self.medium_directory('media_path', protection_path, medium),
 			medium.id + '.' + mime_to_extension(medium.mime)
 		)
-		summary_path = os.path.join(
-			self.config['summaries_path'],
+		summary_directory = self.medium_directory(
+			'summaries_path',
 			protection_path,
-			medium.id + '.{}'
+			medium,
 		)
+		os.makedirs(summary_directory, exist_ok=True)
+		summary_path = os.path.join(summary_directory, medium.id + '.{}')
 
 		if not os.path.exists(file_path):
 			raise ValueError('Original file not found')
 
+		# media are content-addressed so cached probe results never go stale
+		# and only artifact groups that are missing or whose config changed
+		# need to be generated again
+		info, artifacts = self.get_summary_metadata(medium.id_bytes)
+		signatures = self.summary_signatures(medium)
+		stale = []
+		for group, signature in signatures.items():
+			if (
+					not info
+					or group not in artifacts
+					or signature != artifacts[group]
+				):
+				stale.append(group)
+				continue
+			for summary_suffix in self.summary_group_files(medium, group, info):
+				if not os.path.exists(summary_path.format(summary_suffix)):
+					stale.append(group)
+					break
+
 		updates = {}
 		if 'image' == medium.category:
-			img = Image.open(file_path)
-			self.summaries_from_image(img, summary_path)
-
-			updates['data1'] = img.width
-			updates['data2'] = img.height
-			updates['data3'] = hsv_to_int(*hsv_average_from_image(img))
+			if 'static' in stale or 'data3' not in info:
+				stage_start = time.perf_counter()
+				img = Image.open(file_path)
+				info['width'] = img.width
+				info['height'] = img.height
+
+				summary_img = self.prepare_summary_image(img)
+				self.summaries_from_image(summary_img, summary_path)
+				info['data3'] = hsv_to_int(*hsv_average_from_image(summary_img))
+				img.close()
+				self.summary_timings['static_summaries'] = time.perf_counter() - stage_start
+
+			updates['data1'] = info['width']
+			updates['data2'] = info['height']
+			updates['data3'] = info['data3']
 
 			if 'image/gif' == medium.mime:
-				frames = 1
-				try:
-					while True:
-						img.seek(img.tell() + 1)
-						frames += 1
-				except EOFError:
-					pass
-				if 1 < frames:
-					updates['data4'] = frames
-					if self.config['ffmpeg_path']:
-						portrait = (img.width < img.height)
-						for edge in self.config['summary_edges']:
-							if portrait:
-								width = -1
-								height = min(edge, img.height)
-							else:
-								width = min(edge, img.width)
-								height = -1
-
-							ffmpeg_call = [
-								self.config['ffmpeg_path'],
-								'-i',
-								file_path,
-								'-vf',
-								'scale=' + str(width) + ':' + str(height),
-							]
-							if (
-									self.config['ffmpeg_thread_limit']
-									and isinstance(self.config['ffmpeg_thread_limit'], int)
-									and 0 < self.config['ffmpeg_thread_limit']
-								):
-								ffmpeg_call += [
-									'-threads',
-									str(self.config['ffmpeg_thread_limit']),
-								]
-							ffmpeg_call += [
-								summary_path.format(str(edge) + '.gif'),
-							]
-							subprocess.run(ffmpeg_call)
+				if 'frames' not in info:
+					info['frames'], info['duration_ms'] = get_gif_info(file_path)
+				if 1 < info['frames']:
+					updates['data4'] = info['frames']
+					if info['duration_ms']:
+						updates['data5'] = info['duration_ms']
+					if self.config['ffmpeg_path'] and 'animated' in stale:
+						stage_start = time.perf_counter()
+						self.animated_summaries_from_gif(
+							file_path,
+							summary_path,
+							info['width'],
+							info['height'],
+						)
+						self.summary_timings['animated_summaries'] = time.perf_counter() - stage_start
 		elif 'video' == medium.category:
 			if self.config['ffprobe_path'] and self.config['ffmpeg_path']:
-				width, height, duration_s, audio_codec, video_codec = self.get_video_info(file_path)
-
+				# failed or timed out probes leave no duration or dimensions
+				# so they're probed again instead of being cached for good
+				if (
+						not info.get('duration_s')
+						or not info.get('width')
+						or not info.get('height')
+					):
+					stage_start = time.perf_counter()
+					(
+						info['width'],
+						info['height'],
+						info['duration_s'],
+						info['audio_codec'],
+						info['video_codec'],
+					) = self.get_video_info(file_path)
+					self.summary_timings['probe'] = time.perf_counter() - stage_start
+				width = info['width']
+				height = info['height']
+				duration_s = info['duration_s']
+				audio_codec = info['audio_codec']
+				video_codec = info['video_codec']
+
+				reencode = 'reencode' in stale
 				if duration_s:
 					# duration ms
 					duration_ms = int(math.floor(duration_s * 1000))
 					updates['data5'] = duration_ms
 
-					snapshots = self.generate_video_snapshots(file_path, duration_s)
-
-					# use snapshot dimensions if dimensions are missing
-					first_snapshot_path, first_snapshot = snapshots[0]
-					if not width:
-						width = first_snapshot.width
-					if not height:
-						height = first_snapshot.height
-
-					# static summaries from first snapshot
-					self.summaries_from_image(first_snapshot, summary_path)
-					updates['data3'] = hsv_to_int(*hsv_average_from_image(first_snapshot))
+					snapshot = ('static' in stale or 'data3' not in info)
+					start_ms = 0
+					end_ms = 0
+					if 'clip' in stale:
+						start_ms, end_ms = self.video_clip_range(duration_ms)
+					snapshots = []
+					stage_start = time.perf_counter()
+					if self.config['video_single_pass']:
+						# snapshot, clip, and reencode from a single decode
+						if snapshot or 0 < end_ms or reencode:
+							snapshot_path = self.encode_video_summaries(
+								file_path,
+								summary_path,
+								duration_s,
+								snapshot=snapshot,
+								clip_start_ms=start_ms,
+								clip_end_ms=end_ms,
+								reencode=reencode,
+							)
+							self.summary_timings['video_pass'] = time.perf_counter() - stage_start
+							if snapshot_path and os.path.exists(snapshot_path):
+								snapshots.append((snapshot_path, Image.open(snapshot_path)))
+						reencode = False
+					elif snapshot:
+						snapshots = self.generate_video_snapshots(file_path, duration_s)
+						self.summary_timings['snapshots'] = time.perf_counter() - stage_start
+
+					if snapshots:
+						# use snapshot dimensions if dimensions are missing
+						first_snapshot_path, first_snapshot = snapshots[0]
+						if not width:
+							width = info['width'] = first_snapshot.width
+						if not height:
+							height = info['height'] = first_snapshot.height
+
+						# static summaries from first snapshot
+						stage_start = time.perf_counter()
+						self.summaries_from_image(first_snapshot, summary_path)
+						info['data3'] = hsv_to_int(*hsv_average_from_image(first_snapshot))
+						self.summary_timings['static_summaries'] = time.perf_counter() - stage_start
 
-					#TODO create slideshow strip from snapshots
-					#for path, snapshot in snapshots
-						#snapshot.thumbnail(self.config['video_slideshow_edge'])
-					#TODO save slideshow strip with .slideshow.webp and .slideshow.png
-					#TODO remove snapshots
 					for snapshot_path, snapshot in snapshots:
 						snapshot.close()
 						os.remove(snapshot_path)
 
-					if 0 < self.config['video_clip_duration_ms']:
-						if duration_ms <= self.config['video_clip_duration_ms']:
-							start_ms = 0
-							end_ms = duration_ms
-						else:
-							midpoint_ms = duration_ms / 2
-							half_video_clip_duration_ms = self.config['video_clip_duration_ms'] / 2
-							start_ms = midpoint_ms - half_video_clip_duration_ms
-							end_ms = start_ms + self.config['video_clip_duration_ms']
+					if 'slideshow' in stale:
+						# slideshow strip from keyframes
+						stage_start = time.perf_counter()
+						self.generate_video_slideshow(file_path, summary_path, duration_s)
+						self.summary_timings['slideshow'] = time.perf_counter() - stage_start
+
+					if (
+							not self.config['video_single_pass']
+							and 0 < end_ms
+						):
+						stage_start = time.perf_counter()
 						self.reencode_video(
 							file_path,
 							summary_path.format('clip.webm'),
@@ -1766,8 +3420,10 @@ class MediaFrontend(Media):
 							end_ms=end_ms,
 							muted=True
 						)
+						self.summary_timings['clip'] = time.perf_counter() - stage_start
 				# reencode non-websafe video for the view page
-				if not is_websafe_video(medium.mime):
+				if reencode:
+					stage_start = time.perf_counter()
 					self.reencode_video(
 						file_path,
 						summary_path.format('reencoded.webm'),
@@ -1775,6 +3431,9 @@ class MediaFrontend(Media):
 						height,
 						self.config['video_reencode_edge']
 					)
+					self.summary_timings['reencode'] = time.perf_counter() - stage_start
+				if 'data3' in info:
+					updates['data3'] = info['data3']
 				if width:
 					updates['data1'] = width
 				if height:
@@ -1822,8 +3481,25 @@ class MediaFrontend(Media):
 			#TODO no archive summary yet
 			#TODO check for cbr/cbz and get cover summary
 			pass
+		if info:
+			self.set_summary_metadata(medium.id_bytes, info, signatures)
+		if self.config['link_public_files']:
+			self.place_medium_summaries(medium)
+		previous_version = manifest_version(medium.manifest)
+		medium.manifest = self.scan_medium_files(medium)
+		if stale:
+			# summaries keep their filenames when regenerated
+			# so a new version changes their uris for caches
+			version = int(time.time())
+			if previous_version:
+				version = max(version, int(previous_version) + 1)
+			medium.manifest = manifest_with_version(medium.manifest, str(version))
+		self.set_file_manifest(medium.id_bytes, medium.manifest)
+		self.populate_medium_uris(medium)
+		self.remember_medium(medium)
 		if 0 < len(updates):
-			self.update_medium(medium.id_bytes, **updates)
+			self.update_medium(medium.id_bytes, medium=medium, **updates)
+		self.summary_timings['total'] = time.perf_counter() - generation_start
 		subject_id = ''
 		if self.accounts.current_user:
 			subject_id = self.accounts.current_user.id_bytes
@@ -1833,58 +3509,138 @@ class MediaFrontend(Media):
 			object_id=medium.id_bytes,
 		)
 
+	def recalculate_medium_color(self, medium):
+		if (
+				MediumProtection.NONE != medium.protection
+				or MediumStatus.ALLOWED != medium.status
+			):
+			protection_path = 'protected'
+		else:
+			protection_path = 'nonprotected'
+		depth = self.medium_shard_depth(medium)
+		if 'image' == medium.category:
+			source_paths = [
+				os.path.join(
+					self.medium_directory('media_path', protection_path, medium, depth),
+					medium.id + '.' + mime_to_extension(medium.mime),
+				),
+			]
+		elif 'video' == medium.category:
+			# the snapshot isn't kept so use the largest static summary
+			summary_file_template = os.path.join(
+				self.medium_directory(
+					'summaries_path',
+					protection_path,
+					medium,
+					depth,
+				),
+				medium.id + '.' + str(max(self.config['summary_edges'])) + '.',
+			)
+			source_paths = [
+				summary_file_template + 'png',
+				summary_file_template + 'webp',
+			]
+		else:
+			return False
+		for source_path in source_paths:
+			if os.path.exists(source_path):
+				break
+		else:
+			return False
+		img = self.prepare_summary_image(Image.open(source_path))
+		data3 = hsv_to_int(*hsv_average_from_image(img))
+		img.close()
+		if data3 == medium.data3:
+			return False
+		self.update_medium(medium.id_bytes, medium=medium, data3=data3)
+		return True
+
+	def recalculate_media_colors(self, page=0, perpage=100):
+		mimes = categories_to_mimes['image'] + categories_to_mimes['video']
+		media = self.search_media(
+			filter={'with_mimes': mimes},
+			sort='upload_time',
+			order='asc',
+			page=page,
+			perpage=perpage,
+		)
+		results = {
+			'processed': 0,
+			'updated': 0,
+		}
+		for medium in media.values():
+			results['processed'] += 1
+			if self.recalculate_medium_color(medium):
+				results['updated'] += 1
+		return results
+
+	def queue_medium_summaries(self, medium):
+		# generate inline when no background queue is configured
+		if not self.summary_queue:
+			self.generate_medium_summaries(medium)
+			return False
+		self.summary_queue.enqueue(medium.id_bytes)
+		return True
+
+	def process_summary_jobs(self, limit=0):
+		processed = 0
+		while not limit or processed < limit:
+			medium_id, token = self.summary_queue.claim()
+			if not medium_id:
+				break
+			processed += 1
+			medium = self.get_medium(medium_id)
+			if not medium:
+				self.summary_queue.remove(medium_id)
+				continue
+			try:
+				self.generate_medium_summaries(medium)
+			except Exception as e:
+				self.summary_queue.fail(medium_id, token, str(e))
+			else:
+				self.summary_queue.complete(
+					medium_id,
+					token,
+					timings=self.summary_timings,
+				)
+		return processed
+
 	def upload(
 			self,
 			uploader_remote_origin,
 			uploader_id,
 			file_uri='',
 			file_upload='',
+			remote_fetch=None,
+			upload_session_id='',
 		):
 		errors = []
-		file_contents = None
 		filename = ''
-		if file_uri:
+		if remote_fetch:
+			errors, filename, file_path, id, mime, size = remote_fetch.result()
+		elif file_uri:
 			try:
-				response = urllib.request.urlopen(file_uri)
-			except urllib.error.HTTPError as e:
-				errors.append('HTTP error from remote file request')
-			except urllib.error.URLError as e:
-				errors.append('URL error from remote file request')
-			else:
-				if not response:
-					errors.append('Empty response from remote file request')
-				else:
-					file_contents = response.read()
-					filename = file_uri.replace('\\', '/').split('/').pop()
+				errors, filename, file_path, id, mime, size = self.fetch_remote_medium(
+					file_uri
+				)
+			finally:
+				self.close_remote_fetcher()
+		elif upload_session_id:
+			errors, filename, file_path, id, mime, size = self.finish_upload_session(
+				upload_session_id,
+				uploader_id,
+			)
 		elif file_upload:
-			try:
-				file_contents = file_upload.stream.read()
-			except ValueError as e:
-				errors.append('Problem uploading file')
-			else:
-				filename = file_upload.filename
+			filename = file_upload.filename
+			errors, file_path, id, mime, size = self.ingest_medium_stream(
+				file_upload.stream
+			)
 		else:
 			errors.append('Missing medium file')
 
 		if errors:
 			return errors, filename, None
 
-		file_path = self.create_temp_medium_file(file_contents)
-		size = get_file_size(file_path)
-		mime = get_file_mime(file_path)
-
-		if self.config['maximum_upload_filesize'] < size:
-			errors.append('File greater than maximum upload filesize')
-		if mime in self.config['disallowed_mimetypes']:
-			errors.append('Mimetype not allowed')
-
-		if errors:
-			if os.path.exists(file_path):
-				os.remove(file_path)
-			return errors, filename, None
-
-		id = get_file_id(file_path)
-
 		try:
 			medium = self.create_medium(
 				id=id,
@@ -1913,6 +3669,11 @@ class MediaFrontend(Media):
 			return errors, filename, medium
 
 		self.place_medium_file(medium, file_path)
+		# uris were populated on create while the file was still in temp
+		medium.manifest = self.get_file_manifests([medium.id_bytes]).get(
+			medium.id_bytes
+		)
+		self.populate_medium_uris(medium)
 		return errors, filename, medium
 
 	def add_like(self, medium_id, user_id):
@@ -0,0 +1,170 @@
+import ssl
+import socket
+import threading
+import http.client
+import urllib.parse
+
+redirect_statuses = [301, 302, 303, 307, 308]
+# redirect bodies larger than this close the connection instead of draining
+redirect_drain_size = 65536
+
+class RemoteFileError(ValueError):
+	# messages meant for the uploader, unlike other stream errors
+	pass
+
+class RemoteFileStream:
+	# reads a response body, rejecting bodies that end before their
+	# declared length since http.client returns what it has on early close
+	def __init__(self, response):
+		self.response = response
+		self.expected_size = None
+		content_length = response.getheader('Content-Length')
+		if content_length and content_length.isdigit():
+			self.expected_size = int(content_length)
+		self.received = 0
+
+	def read(self, amt=None):
+		try:
+			chunk = self.response.read(amt)
+		except socket.timeout:
+			raise RemoteFileError('Timed out fetching remote file')
+		except (OSError, http.client.HTTPException):
+			raise RemoteFileError('Remote file transfer interrupted')
+		self.received += len(chunk)
+		if (
+				not chunk
+				and None != self.expected_size
+				and self.received < self.expected_size
+			):
+			raise RemoteFileError('Remote file transfer incomplete')
+		return chunk
+
+class RemoteFetcher:
+	def __init__(
+			self,
+			connect_timeout=10,
+			read_timeout=30,
+			maximum_size=0,
+			maximum_redirects=5,
+			user_agent='mediafrontend',
+		):
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+		self.maximum_size = maximum_size
+		self.maximum_redirects = maximum_redirects
+		self.user_agent = user_agent
+		# idle keep-alive connections by scheme, host, and port
+		self.idle_connections = {}
+		self.lock = threading.Lock()
+
+	def acquire(self, key):
+		with self.lock:
+			if self.idle_connections.get(key):
+				return self.idle_connections[key].pop(), True
+		scheme, host, port = key
+		if 'https' == scheme:
+			connection = http.client.HTTPSConnection(
+				host,
+				port,
+				timeout=self.connect_timeout,
+				context=ssl.create_default_context(),
+			)
+		else:
+			connection = http.client.HTTPConnection(
+				host,
+				port,
+				timeout=self.connect_timeout,
+			)
+		connection.connect()
+		connection.sock.settimeout(self.read_timeout)
+		return connection, False
+
+	def release(self, key, connection, response):
+		# only fully read responses leave a connection ready for reuse
+		if response.isclosed() and not response.will_close:
+			with self.lock:
+				if key not in self.idle_connections:
+					self.idle_connections[key] = []
+				self.idle_connections[key].append(connection)
+		else:
+			connection.close()
+
+	def close(self):
+		with self.lock:
+			for connections in self.idle_connections.values():
+				for connection in connections:
+					connection.close()
+			self.idle_connections = {}
+
+	def request(self, uri):
+		parsed = urllib.parse.urlsplit(uri)
+		if parsed.scheme not in ['http', 'https'] or not parsed.hostname:
+			raise ValueError('URL error from remote file request')
+		port = parsed.port
+		if not port:
+			port = 443 if 'https' == parsed.scheme else 80
+		key = (parsed.scheme, parsed.hostname, port)
+		path = parsed.path or '/'
+		if parsed.query:
+			path += '?' + parsed.query
+
+		connection, reused = self.acquire(key)
+		try:
+			connection.request('GET', path, headers={'User-Agent': self.user_agent})
+			response = connection.getresponse()
+		except (
+				http.client.RemoteDisconnected,
+				BrokenPipeError,
+				ConnectionResetError,
+			):
+			connection.close()
+			# idle keep-alive connections may have been closed by the server
+			if not reused:
+				raise
+			connection, reused = self.acquire(key)
+			connection.request('GET', path, headers={'User-Agent': self.user_agent})
+			response = connection.getresponse()
+		return key, connection, response
+
+	def open(self, uri):
+		try:
+			for i in range(self.maximum_redirects + 1):
+				key, connection, response = self.request(uri)
+				if response.status not in redirect_statuses:
+					break
+				location = response.getheader('Location')
+				# drain short redirect bodies so the connection can be reused
+				# release closes the connection if anything is left unread
+				response.read(redirect_drain_size)
+				self.release(key, connection, response)
+				if not location:
+					raise ValueError('HTTP error from remote file request')
+				uri = urllib.parse.urljoin(uri, location)
+			else:
+				raise ValueError('HTTP error from remote file request')
+		except socket.timeout:
+			raise ValueError('Timed out fetching remote file')
+		except (OSError, http.client.HTTPException):
+			raise ValueError('URL error from remote file request')
+
+		if 200 != response.status:
+			connection.close()
+			raise ValueError('HTTP error from remote file request')
+		content_length = response.getheader('Content-Length')
+		if (
+				self.maximum_size
+				and content_length
+				and content_length.isdigit()
+				and self.maximum_size < int(content_length)
+			):
+			# reject before downloading anything
+			connection.close()
+			raise ValueError('File greater than maximum upload filesize')
+		return key, connection, response
+
+	def fetch(self, uri, consume):
+		key, connection, response = self.open(uri)
+		try:
+			return consume(RemoteFileStream(response))
+		finally:
+			self.release(key, connection, response)
@@ -0,0 +1,218 @@
+import time
+import uuid
+import json
+import sqlite3
+import threading
+import multiprocessing
+
+# queue database paths whose schema this process has already set up
+initialized_paths = set()
+initialized_paths_lock = threading.Lock()
+
+class SummaryJobStatus:
+	QUEUED = 'queued'
+	RUNNING = 'running'
+	COMPLETE = 'complete'
+	FAILED = 'failed'
+
+class SummaryQueue:
+	def __init__(self, db_path, stale_job_period=3600, timeout=30):
+		self.db_path = db_path
+		self.stale_job_period = stale_job_period
+		self.timeout = timeout
+
+		# queues are constructed per request so only set up once per process
+		with initialized_paths_lock:
+			if self.db_path in initialized_paths:
+				return
+			self.install()
+			initialized_paths.add(self.db_path)
+
+	def install(self):
+		connection = self.connect()
+		with connection:
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.execute(
+				'CREATE TABLE IF NOT EXISTS summary_jobs ('
+					+ 'medium_id BLOB PRIMARY KEY, '
+					+ 'status TEXT NOT NULL, '
+					+ 'token TEXT, '
+					+ 'enqueue_time INTEGER NOT NULL, '
+					+ 'start_time INTEGER, '
+					+ 'end_time INTEGER, '
+					+ 'attempts INTEGER NOT NULL DEFAULT 0, '
+					+ 'error TEXT, '
+					+ 'timings TEXT'
+				+ ')'
+			)
+			connection.execute(
+				'CREATE INDEX IF NOT EXISTS summary_jobs_status '
+					+ 'ON summary_jobs (status, enqueue_time)'
+			)
+		connection.close()
+
+	def connect(self):
+		# connections are opened per operation so the queue is safe to share
+		# between request handlers and forked worker processes
+		connection = sqlite3.connect(
+			self.db_path,
+			timeout=self.timeout,
+			isolation_level=None,
+		)
+		return connection
+
+	def enqueue(self, medium_id):
+		# re-enqueueing a running job puts it back to queued, which makes the
+		# running worker's completion a no-op so the medium is processed again
+		connection = self.connect()
+		connection.execute(
+			'INSERT INTO summary_jobs (medium_id, status, token, enqueue_time) '
+				+ 'VALUES (?, ?, NULL, ?) '
+				+ 'ON CONFLICT (medium_id) DO UPDATE SET '
+					+ 'status = excluded.status, '
+					+ 'token = NULL, '
+					+ 'enqueue_time = excluded.enqueue_time, '
+					+ 'start_time = NULL, '
+					+ 'end_time = NULL, '
+					+ 'attempts = 0, '
+					+ 'error = NULL, '
+					+ 'timings = NULL',
+			(medium_id, SummaryJobStatus.QUEUED, int(time.time())),
+		)
+		connection.close()
+
+	def claim(self):
+		connection = self.connect()
+		try:
+			connection.execute('BEGIN IMMEDIATE')
+			# return jobs abandoned by crashed workers to the queue
+			connection.execute(
+				'UPDATE summary_jobs SET status = ?, token = NULL '
+					+ 'WHERE status = ? AND start_time < ?',
+				(
+					SummaryJobStatus.QUEUED,
+					SummaryJobStatus.RUNNING,
+					int(time.time()) - self.stale_job_period,
+				),
+			)
+			row = connection.execute(
+				'SELECT medium_id FROM summary_jobs WHERE status = ? '
+					+ 'ORDER BY enqueue_time ASC LIMIT 1',
+				(SummaryJobStatus.QUEUED,),
+			).fetchone()
+			if not row:
+				connection.execute('COMMIT')
+				return None, None
+			medium_id = row[0]
+			token = str(uuid.uuid4())
+			connection.execute(
+				'UPDATE summary_jobs SET status = ?, token = ?, start_time = ?, '
+					+ 'attempts = attempts + 1 WHERE medium_id = ?',
+				(SummaryJobStatus.RUNNING, token, int(time.time()), medium_id),
+			)
+			connection.execute('COMMIT')
+		except:
+			connection.execute('ROLLBACK')
+			raise
+		finally:
+			connection.close()
+		return medium_id, token
+
+	def finish(self, medium_id, token, status, error=None, timings=None):
+		if timings:
+			timings = json.dumps(timings)
+		connection = self.connect()
+		connection.execute(
+			'UPDATE summary_jobs SET status = ?, end_time = ?, error = ?, '
+				+ 'timings = ? WHERE medium_id = ? AND token = ? AND status = ?',
+			(
+				status,
+				int(time.time()),
+				error,
+				timings,
+				medium_id,
+				token,
+				SummaryJobStatus.RUNNING,
+			),
+		)
+		connection.close()
+
+	def complete(self, medium_id, token, timings=None):
+		self.finish(medium_id, token, SummaryJobStatus.COMPLETE, timings=timings)
+
+	def fail(self, medium_id, token, error=''):
+		self.finish(medium_id, token, SummaryJobStatus.FAILED, error)
+
+	def remove(self, medium_id):
+		connection = self.connect()
+		connection.execute(
+			'DELETE FROM summary_jobs WHERE medium_id = ?',
+			(medium_id,),
+		)
+		connection.close()
+
+	def get_statuses(self, medium_ids):
+		if not medium_ids:
+			return {}
+		connection = self.connect()
+		statuses = {}
+		# stay under sqlite's bound parameter limit
+		for i in range(0, len(medium_ids), 500):
+			chunk = medium_ids[i:i + 500]
+			rows = connection.execute(
+				'SELECT medium_id, status FROM summary_jobs WHERE medium_id IN ('
+					+ ', '.join(['?'] * len(chunk))
+					+ ')',
+				chunk,
+			).fetchall()
+			for medium_id, status in rows:
+				statuses[bytes(medium_id)] = status
+		connection.close()
+		return statuses
+
+	def get_timings(self, status=SummaryJobStatus.COMPLETE, limit=100):
+		# per-stage timings of recently finished jobs for comparing pipelines
+		connection = self.connect()
+		rows = connection.execute(
+			'SELECT medium_id, timings FROM summary_jobs '
+				+ 'WHERE status = ? AND timings IS NOT NULL '
+				+ 'ORDER BY end_time DESC LIMIT ?',
+			(status, limit),
+		).fetchall()
+		connection.close()
+		timings = {}
+		for medium_id, medium_timings in rows:
+			timings[bytes(medium_id)] = json.loads(medium_timings)
+		return timings
+
+def summary_worker(create_media, poll_interval=1):
+	# create_media is called inside the worker process and must return
+	# a MediaFrontend ready for use, including any app context url_for needs
+	media = create_media()
+	while True:
+		if not media.process_summary_jobs(limit=1):
+			time.sleep(poll_interval)
+
+def run_summary_workers(config, create_media, poll_interval=1):
+	def start_worker():
+		worker = multiprocessing.Process(
+			target=summary_worker,
+			args=(create_media, poll_interval),
+		)
+		worker.start()
+		return worker
+
+	workers = []
+	for i in range(max(1, config['summary_workers'])):
+		workers.append(start_worker())
+	try:
+		# replace any worker that dies so the pool stays at full size
+		while True:
+			for i, worker in enumerate(workers):
+				if not worker.is_alive():
+					workers[i] = start_worker()
+			time.sleep(poll_interval)
+	finally:
+		for worker in workers:
+			if worker.is_alive():
+				worker.terminate()
@@ -0,0 +1,140 @@
+import os
+import time
+import uuid
+import json
+import fcntl
+import hashlib
+import threading
+
+# bytes read from chunk request bodies at a time
+chunk_read_size = 1048576
+
+# running md5 of each session's received bytes by session id, only valid
+# for sessions whose chunks were all appended by this process
+hash_states = {}
+hash_states_lock = threading.Lock()
+
+def parse_session_id(session_id):
+	try:
+		return uuid.UUID(session_id).hex
+	except (ValueError, TypeError, AttributeError):
+		return ''
+
+class UploadSessions:
+	def __init__(self, path, maximum_size, session_period=86400):
+		self.path = path
+		self.maximum_size = maximum_size
+		self.session_period = session_period
+
+	def session_path(self, session_id):
+		return os.path.join(self.path, 'upload_session_' + session_id + '.json')
+
+	def part_path(self, session_id):
+		return os.path.join(self.path, 'upload_session_' + session_id + '.part')
+
+	def create(self, owner_id, filename, size):
+		if self.maximum_size < size:
+			raise ValueError('File greater than maximum upload filesize')
+		self.remove_expired()
+		session_id = uuid.uuid4().hex
+		open(self.part_path(session_id), 'wb').close()
+		with open(self.session_path(session_id), 'w') as f:
+			json.dump(
+				{
+					'owner_id': owner_id,
+					'filename': filename,
+					'size': size,
+					'creation_time': int(time.time()),
+				},
+				f,
+			)
+		with hash_states_lock:
+			hash_states[session_id] = (0, hashlib.md5())
+		return session_id
+
+	def get(self, session_id):
+		session_id = parse_session_id(session_id)
+		if not session_id:
+			return None
+		try:
+			with open(self.session_path(session_id), 'r') as f:
+				session = json.load(f)
+			session['offset'] = os.path.getsize(self.part_path(session_id))
+		except (OSError, ValueError):
+			return None
+		session['id'] = session_id
+		return session
+
+	def append(self, session, offset, stream):
+		# chunks must arrive in order, a client resumes from the offset
+		# reported by the session after a dropped connection
+		with open(self.part_path(session['id']), 'ab') as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			received = f.seek(0, os.SEEK_END)
+			if offset != received:
+				raise ValueError('Upload offset mismatch')
+			with hash_states_lock:
+				hash_state = hash_states.pop(session['id'], None)
+			if hash_state and hash_state[0] != received:
+				hash_state = None
+			try:
+				for chunk in iter(lambda: stream.read(chunk_read_size), b''):
+					if session['size'] < received + len(chunk):
+						raise ValueError('Upload greater than declared filesize')
+					f.write(chunk)
+					if hash_state:
+						hash_state[1].update(chunk)
+					received += len(chunk)
+			finally:
+				# bytes that arrived before an interruption are kept
+				if hash_state:
+					with hash_states_lock:
+						hash_states[session['id']] = (received, hash_state[1])
+		# active sessions don't expire
+		os.utime(self.session_path(session['id']))
+		return received
+
+	def finish(self, session):
+		part_path = self.part_path(session['id'])
+		size = os.path.getsize(part_path)
+		if session['size'] != size:
+			raise ValueError('Upload incomplete')
+		with hash_states_lock:
+			hash_state = hash_states.pop(session['id'], None)
+		if hash_state and size == hash_state[0]:
+			digest = hash_state[1].digest()
+		else:
+			# chunks were received by another process so hash from disk
+			hash_algo = hashlib.md5()
+			with open(part_path, 'rb') as f:
+				for chunk in iter(lambda: f.read(chunk_read_size), b''):
+					hash_algo.update(chunk)
+			digest = hash_algo.digest()
+		os.remove(self.session_path(session['id']))
+		return part_path, digest, size
+
+	def remove(self, session_id):
+		with hash_states_lock:
+			hash_states.pop(session_id, None)
+		for file_path in [
+				self.session_path(session_id),
+				self.part_path(session_id),
+			]:
+			if os.path.exists(file_path):
+				os.remove(file_path)
+
+	def remove_expired(self):
+		expired_time = time.time() - self.session_period
+		for filename in os.listdir(self.path):
+			if (
+					not filename.startswith('upload_session_')
+					or not filename.endswith('.json')
+				):
+				continue
+			file_path = os.path.join(self.path, filename)
+			try:
+				if expired_time < os.path.getmtime(file_path):
+					continue
+			except OSError:
+				continue
+			self.remove(filename[len('upload_session_'):-len('.json')])
@@ -7,10 +7,15 @@ from datetime import datetime, timezone
 import math
 import re
 import json
+import mimetypes
+import urllib.parse
 
 from flask import Blueprint, render_template, abort, request, redirect, jsonify
 from flask import url_for, g, send_from_directory, make_response
 import dateutil.parser
+from werkzeug.http import parse_content_range_header
+from werkzeug.security import safe_join
+from sqlalchemy.exc import SQLAlchemyError
 
 from .. import MediaFrontend
 from media import MediumStatus, MediumProtection
@@ -33,6 +38,7 @@ def initialize(
 		engine,
 		install=install,
 		connection=connection,
+		identity_map=True,
 	)
 
 	# use default medium and tags file uris if custom uris aren't specified
@@ -69,6 +75,56 @@ def require_medium(id):
 	else:
 		return medium
 
+def send_media_file(root, directory, filename, private=False):
+	file_path = safe_join(directory, filename)
+	if not file_path:
+		abort(404)
+	# filenames are content-addressed and regenerated summaries
+	# get a new version in their uris so responses never go stale
+	etag = os.path.basename(filename)
+	if 'v' in request.args:
+		etag += '-' + request.args['v']
+	offload = g.media.config['file_offload']
+	if not offload:
+		r = send_from_directory(
+			directory,
+			filename,
+			conditional=True,
+			etag=etag,
+			max_age=g.media.config['media_cache_max_age'],
+		)
+	else:
+		# access checks are done so let the front proxy stream the file
+		r = make_response('')
+		mimetype, encoding = mimetypes.guess_type(filename)
+		r.mimetype = mimetype or 'application/octet-stream'
+		r.set_etag(etag)
+		r.cache_control.max_age = g.media.config['media_cache_max_age']
+	r.cache_control.immutable = True
+	if private:
+		r.cache_control.public = False
+		r.cache_control.private = True
+	else:
+		r.cache_control.public = True
+	if not offload:
+		return r
+	# revalidations are answered here since the front proxy replaces the etag
+	r = r.make_conditional(request)
+	if 304 == r.status_code:
+		return r
+	if 'x-accel-redirect' == offload:
+		r.headers['X-Accel-Redirect'] = (
+			g.media.config['offload_uris'][root]
+			+ urllib.parse.quote(
+				os.path.relpath(file_path, g.media.config[root]).replace(os.sep, '/')
+			)
+		)
+	elif 'x-sendfile' == offload:
+		r.headers['X-Sendfile'] = os.path.abspath(file_path)
+	else:
+		abort(500)
+	return r
+
 media_static = Blueprint(
 	'media_static',
 	__name__,
@@ -76,7 +132,7 @@ media_static = Blueprint(
 	static_url_path='/static',
 )
 
-@media_static.route('/files/<medium_filename>')
+@media_static.route('/files/<path:medium_filename>')
 def medium_file(medium_filename):
 	nonprotected_media_path = os.path.join(
 		g.media.config['media_path'],
@@ -89,13 +145,13 @@ def medium_file(medium_filename):
 			)
 		):
 		abort(404)
-	return send_from_directory(
+	return send_media_file(
+		'media_path',
 		nonprotected_media_path,
 		medium_filename,
-		conditional=True,
 	)
 
-@media_static.route('/summaries/<summary_filename>')
+@media_static.route('/summaries/<path:summary_filename>')
 def summary_file(summary_filename):
 	nonprotected_summary_path = os.path.join(
 		g.media.config['summaries_path'],
@@ -108,10 +164,10 @@ def summary_file(summary_filename):
 			)
 		):
 		abort(404)
-	return send_from_directory(
+	return send_media_file(
+		'summaries_path',
 		nonprotected_summary_path,
 		summary_filename,
-		conditional=True,
 	)
 
 @media_static.route('/tags/<tags_filename>')
@@ -186,6 +242,7 @@ def api_access_not_allowed(medium, owner_or_manager_only=False):
 def api_response_thumbnails(media, response_data=None):
 	if not response_data:
 		response_data = {'media': {}}
+	g.media.populate_media_summary_jobs(media)
 	for medium in media.values():
 		response_data['media'][medium.id] = {
 			'thumbnail': render_template(
@@ -204,51 +261,54 @@ def api_response_thumbnails(media, response_data=None):
 				'\t',
 				'',
 			),
+			'summary_job': medium.summary_job,
 		}
 	return response_data
 
 @media_api.route('/fetch_medium/<medium_filename>')
 @require_sign_in
 def api_fetch_medium(medium_filename):
-	protected_media_path = os.path.join(
-		g.media.config['media_path'],
+	medium_id = medium_filename.split('.')[0]
+	medium = require_medium(medium_id)
+	protected_media_path = g.media.find_medium_directory(
+		'media_path',
 		'protected',
+		medium,
+		medium_filename,
 	)
-	if not os.path.exists(
-			os.path.join(protected_media_path, medium_filename)
-		):
+	if not protected_media_path:
 		return '', 404
-	medium_id = medium_filename.split('.')[0]
-	medium = require_medium(medium_id)
 	response = api_access_not_allowed(medium)
 	if response:
 		return response
-	return send_from_directory(
+	return send_media_file(
+		'media_path',
 		protected_media_path,
 		medium_filename,
-		conditional=True,
+		private=True,
 	)
 
 @media_api.route('/fetch_summary/<summary_filename>')
 @require_sign_in
 def api_fetch_summary(summary_filename):
-	protected_summaries_path = os.path.join(
-		g.media.config['summaries_path'],
+	medium_id = summary_filename.split('.')[0]
+	medium = require_medium(medium_id)
+	protected_summaries_path = g.media.find_medium_directory(
+		'summaries_path',
 		'protected',
+		medium,
+		summary_filename,
 	)
-	if not os.path.exists(
-			os.path.join(protected_summaries_path, summary_filename)
-		):
+	if not protected_summaries_path:
 		return '', 404
-	medium_id = summary_filename.split('.')[0]
-	medium = require_medium(medium_id)
 	response = api_access_not_allowed(medium)
 	if response:
 		return response
-	return send_from_directory(
+	return send_media_file(
+		'summaries_path',
 		protected_summaries_path,
 		summary_filename,
-		conditional=True,
+		private=True,
 	)
 
 @media_api.route('/tags/build', methods=['POST'])
@@ -266,6 +326,37 @@ def api_build_tag_suggestions():
 	g.media.build_tag_suggestions()
 	return '', 200
 
+@media_api.route('/maintenance/<task>', methods=['POST'])
+@require_sign_in
+def api_maintenance(task):
+	if not g.media.accounts.current_user.has_permission(group_names='manager'):
+		return '', 403
+	# maintenance tasks process one page per request
+	# so callers repeat with the next page until nothing is processed
+	page = 0
+	perpage = 100
+	try:
+		if 'page' in request.form:
+			page = max(0, int(request.form['page']))
+		if 'perpage' in request.form:
+			perpage = int(request.form['perpage'])
+	except ValueError:
+		abort(400)
+	perpage = max(1, min(perpage, g.media.config['maximum_maintenance_perpage']))
+	if 'colors' == task:
+		results = g.media.recalculate_media_colors(page=page, perpage=perpage)
+	elif 'manifests' == task:
+		results = g.media.verify_media_manifests(page=page, perpage=perpage)
+	elif 'layout' == task:
+		results = g.media.migrate_media_layout(page=page, perpage=perpage)
+	elif 'semantic_tags' == task:
+		results = g.media.store_media_semantic_tags(page=page, perpage=perpage)
+	else:
+		return '', 404
+	r = make_response(json.dumps(results))
+	r.mimetype = 'application/json'
+	return r, 200
+
 @media_api.route('/tags/<mode>', methods=['POST'])
 @require_sign_in
 def api_tags(mode):
@@ -304,6 +395,263 @@ def api_upload_medium():
 		return '', 400
 	return upload_media(request.form['view_endpoint'], api_request=True)
 
+@media_api.route('/medium/upload_session', methods=['POST'])
+@require_sign_in
+def api_create_upload_session():
+	if not g.media.accounts.current_user.has_permission(
+			group_names='contributor',
+		):
+		return '', 403
+	if 'size' not in request.form:
+		return '', 400
+	try:
+		size = int(request.form['size'])
+	except ValueError:
+		return '', 400
+	if 1 > size:
+		return '', 400
+	filename = ''
+	if 'filename' in request.form:
+		filename = request.form['filename']
+	try:
+		session_id = g.media.upload_sessions.create(
+			g.media.accounts.current_user.id,
+			filename,
+			size,
+		)
+	except ValueError as e:
+		r = make_response(json.dumps({'errors': [str(e)]}))
+		r.mimetype = 'application/json'
+		return r, 400
+	r = make_response(json.dumps({'session_id': session_id, 'offset': 0}))
+	r.mimetype = 'application/json'
+	return r, 200
+
+@media_api.route('/medium/upload_session/<session_id>', methods=['GET', 'PUT'])
+@require_sign_in
+def api_upload_session(session_id):
+	session = g.media.upload_sessions.get(session_id)
+	if (
+			not session
+			or g.media.accounts.current_user.id != session['owner_id']
+		):
+		return '', 404
+	errors = []
+	if 'PUT' == request.method:
+		content_range = parse_content_range_header(
+			request.headers.get('Content-Range')
+		)
+		if not content_range or 'bytes' != content_range.units:
+			return '', 400
+		try:
+			session['offset'] = g.media.upload_sessions.append(
+				session,
+				content_range.start,
+				request.stream,
+			)
+		except ValueError as e:
+			errors.append(str(e))
+			session = g.media.upload_sessions.get(session_id)
+		except OSError:
+			errors.append('Problem uploading file')
+			session = g.media.upload_sessions.get(session_id)
+	# clients resume by sending bytes from the returned offset
+	response_data = {'offset': session['offset'], 'size': session['size']}
+	if errors:
+		response_data['errors'] = errors
+	r = make_response(json.dumps(response_data))
+	r.mimetype = 'application/json'
+	if errors:
+		return r, 409
+	return r, 200
+
+@media_api.route('/medium/upload_batch', methods=['POST'])
+@require_sign_in
+def api_upload_media_batch():
+	if not g.media.accounts.current_user.has_permission(
+			group_names='contributor',
+		):
+		return '', 403
+	if 'view_endpoint' not in request.form:
+		return '', 400
+	view_endpoint = request.form['view_endpoint']
+	file_uris = []
+	if 'file_uris' in request.form:
+		for file_uri in request.form['file_uris'].splitlines():
+			file_uri = file_uri.strip()
+			if file_uri:
+				file_uris.append(file_uri)
+	file_uploads = []
+	for file_upload in request.files.getlist('file_upload'):
+		if '' != file_upload.filename:
+			file_uploads.append(file_upload)
+	if (
+			(not file_uris and not file_uploads)
+			or (
+				g.media.config['maximum_upload_batch_size']
+				< len(file_uris) + len(file_uploads)
+			)
+		):
+		return '', 400
+	results = g.media.upload_batch(
+		request.remote_addr,
+		g.media.accounts.current_user.id,
+		file_uris=file_uris,
+		file_uploads=file_uploads,
+	)
+
+	response_files = []
+	uploaded = []
+	for errors, filename, medium in results:
+		response_file = {'filename': filename}
+		response_files.append(response_file)
+		if errors:
+			response_file['errors'] = errors
+			if 'Medium already exists' in errors:
+				response_file['view_uri'] = url_for(
+					view_endpoint,
+					medium_id=medium.id,
+				)
+			continue
+		uploaded.append((response_file, filename, medium))
+
+	if uploaded:
+		# shared tags
+		tags = []
+		if 'tags' in request.form:
+			tags += g.media.tag_string_to_list(request.form['tags'])
+		# each file is applied on its own so one failure doesn't affect the rest
+		applied = []
+		for response_file, filename, medium in uploaded:
+			try:
+				errors, updates = parse_medium_updates(medium)
+			except ValueError:
+				errors = ['Invalid medium properties']
+			if not errors:
+				try:
+					updated_medium = g.media.update_medium(
+						medium.id,
+						medium=medium,
+						**updates
+					)
+					if not updated_medium:
+						raise ValueError('Medium not found')
+					medium = updated_medium
+					medium_tags = list(tags)
+					if 'author_tag' in request.form:
+						owner = g.media.accounts.get_user(medium.owner_id)
+						if owner and owner.display:
+							medium_tags.append('creator:' + owner.display)
+					if 'filename_tag' in request.form and filename:
+						medium_tags.append('filename:' + filename)
+					if medium_tags:
+						g.media.add_tags(medium.id_bytes, medium_tags)
+				except (ValueError, OSError, SQLAlchemyError):
+					errors = ['Problem updating medium']
+			if errors:
+				# remove the medium so the file can be uploaded again
+				try:
+					g.media.remove_medium(medium)
+				except (ValueError, OSError, SQLAlchemyError):
+					response_file['view_uri'] = url_for(
+						view_endpoint,
+						medium_id=medium.id,
+					)
+				response_file['errors'] = errors
+				continue
+			applied.append((response_file, filename, medium))
+		uploaded = applied
+
+	if uploaded:
+		medium_ids = []
+		for response_file, filename, medium in uploaded:
+			medium_ids.append(medium.id_bytes)
+		media = g.media.search_media(
+			filter={'ids': medium_ids},
+			perpage=len(medium_ids),
+		)
+		if 'generate_summaries' in request.form:
+			for medium in media.values():
+				# catch everything here and return generic error if something goes wrong
+				try:
+					g.media.queue_medium_summaries(medium)
+				except:
+					#TODO actually return error back up
+					pass
+			media = g.media.search_media(
+				filter={'ids': medium_ids},
+				perpage=len(medium_ids),
+			)
+		g.media.populate_media_users(media)
+		g.media.populate_media_summary_jobs(media)
+		for response_file, filename, medium in uploaded:
+			medium = media.get(medium.id)
+			if not medium:
+				response_file['errors'] = ['Medium not found']
+				continue
+			response_file['thumbnail'] = render_template(
+				'medium_thumbnail.html',
+				medium=medium,
+				override_endpoint=view_endpoint,
+				tags_query='',
+				tiles=False,
+				kwargs={},
+			)
+			response_file['summary_job'] = medium.summary_job
+
+	r = make_response(json.dumps({'files': response_files}))
+	r.mimetype = 'application/json'
+	return r, 200
+
+@media_api.route('/medium/exists', methods=['POST'])
+@require_sign_in
+def api_media_exist():
+	if (
+			not g.media.accounts.current_user.has_permission(
+				group_names='contributor',
+			)
+			and not g.media.accounts.current_user.has_permission(
+				group_names='manager',
+			)
+		):
+		return '', 403
+	if 'md5s' not in request.form:
+		return '', 400
+	md5s = []
+	for md5 in request.form['md5s'].split(','):
+		md5 = md5.strip().lower()
+		if md5 and md5 not in md5s:
+			md5s.append(md5)
+	if (
+			not md5s
+			or g.media.config['maximum_existence_checks'] < len(md5s)
+		):
+		return '', 400
+	medium_ids = []
+	for md5 in md5s:
+		try:
+			medium_id = bytes.fromhex(md5)
+		except ValueError:
+			return '', 400
+		if 16 != len(medium_id):
+			return '', 400
+		medium_ids.append(medium_id)
+	existing = g.media.find_existing_media(medium_ids)
+	response_data = {'media': {}}
+	for md5, medium_id in zip(md5s, medium_ids):
+		if medium_id not in existing:
+			response_data['media'][md5] = {'exists': False}
+			continue
+		medium = existing[medium_id]
+		response_data['media'][md5] = {
+			'exists': True,
+			'id': medium.id,
+			'status': str(medium.status).lower(),
+		}
+	r = make_response(json.dumps(response_data))
+	r.mimetype = 'application/json'
+	return r, 200
+
 @media_api.route('/medium/edit', methods=['POST'])
 @require_sign_in
 def api_edit_medium():
@@ -336,7 +684,7 @@ def api_generate_medium_summaries():
 		return response
 	# catch everything here and return generic error if something goes wrong
 	try:
-		g.media.generate_medium_summaries(medium)
+		g.media.queue_medium_summaries(medium)
 	except:
 		return '', 400
 	# refetch after changes
@@ -347,6 +695,23 @@ def api_generate_medium_summaries():
 	r.mimetype = 'application/json'
 	return r, 200
 
+@media_api.route('/medium/summary_jobs', methods=['POST'])
+@require_sign_in
+def api_medium_summary_jobs():
+	if 'medium_ids' not in request.form:
+		return '', 400
+	medium_ids = request.form['medium_ids'].split(',')
+	media = g.media.search_media(filter={'ids': medium_ids})
+	for medium in media.values():
+		response = api_access_not_allowed(medium, owner_or_manager_only=True)
+		if response:
+			return response
+	g.media.populate_media_covers(media)
+	response_data = api_response_thumbnails(media)
+	r = make_response(json.dumps(response_data))
+	r.mimetype = 'application/json'
+	return r, 200
+
 @media_api.route('/generate_set', methods=['POST'])
 def api_generate_media_set():
 	if 'medium_ids' not in request.form:
@@ -504,6 +869,9 @@ def upload_media(view_endpoint, api_request=False):
 		upload_opts['file_uri'] = request.form['file_uri']
 	elif 'file_upload' in request.files and '' != request.files['file_upload'].filename:
 		upload_opts['file_upload'] = request.files['file_upload']
+	elif 'upload_session_id' in request.form and request.form['upload_session_id']:
+		# resumable upload finished through the session endpoints
+		upload_opts['upload_session_id'] = request.form['upload_session_id']
 	errors, filename, medium = g.media.upload(
 		request.remote_addr,
 		uploader_id,
@@ -576,7 +944,13 @@ def upload_media(view_endpoint, api_request=False):
 			tiles=False,
 			kwargs={},
 		)
-		r = make_response(json.dumps({'thumbnail': thumbnail}))
+		g.media.populate_media_summary_jobs(medium)
+		r = make_response(
+			json.dumps({
+				'thumbnail': thumbnail,
+				'summary_job': medium.summary_job,
+			})
+		)
 		r.mimetype = 'application/json'
 		return r, 200
 	return redirect(
@@ -584,40 +958,7 @@ def upload_media(view_endpoint, api_request=False):
 		code=303,
 	)
 
-def process_edit_medium(medium, ignore_replacement=True):
-	if not ignore_replacement:
-		# process edit media replacement file
-		replacement_opts = {}
-		if 'file_uri' in request.form and request.form['file_uri']:
-			replacement_opts['file_uri'] = request.form['file_uri']
-		elif 'file_upload' in request.files and '' != request.files['file_upload'].filename:
-			replacement_opts['file_upload'] = request.files['file_upload']
-		if replacement_opts:
-			errors, filename, replacement_medium = g.media.upload(
-				request.remote_addr,
-				medium.owner_id,
-				**replacement_opts,
-			)
-			if errors:
-				return errors, replacement_medium
-			# update with existing medium properties
-			g.media.update_medium(
-				replacement_medium.id_bytes,
-				creation_time=medium.creation_time,
-				owner_id=medium.owner_id,
-				status=medium.status,
-				protection=medium.protection,
-				searchability=medium.searchability,
-				group_bits=medium.group_bits,
-				focus=medium.focus,
-			)
-			# copy existing tags from original medium
-			g.media.add_tags(replacement_medium.id, medium.tags)
-			#TODO get likes for original medium
-			#TODO add them to replacement medium
-			g.media.remove_medium(medium)
-			medium = replacement_medium
-
+def parse_medium_updates(medium):
 	errors = []
 	updates = {}
 	# no need for manager checks here
@@ -681,7 +1022,7 @@ def process_edit_medium(medium, ignore_replacement=True):
 		updates['focus'] = float(request.form['focus'])
 
 	if errors:
-		return errors, medium
+		return errors, updates
 
 	groups = parse_submitted_groups()
 	updates['group_bits'] = 0
@@ -690,28 +1031,69 @@ def process_edit_medium(medium, ignore_replacement=True):
 			g.media.accounts.combine_groups(names=groups),
 			'big'
 		)
+	return errors, updates
+
+def process_edit_medium(medium, ignore_replacement=True):
+	if not ignore_replacement:
+		# process edit media replacement file
+		replacement_opts = {}
+		if 'file_uri' in request.form and request.form['file_uri']:
+			replacement_opts['file_uri'] = request.form['file_uri']
+		elif 'file_upload' in request.files and '' != request.files['file_upload'].filename:
+			replacement_opts['file_upload'] = request.files['file_upload']
+		if replacement_opts:
+			errors, filename, replacement_medium = g.media.upload(
+				request.remote_addr,
+				medium.owner_id,
+				**replacement_opts,
+			)
+			if errors:
+				return errors, replacement_medium
+			# update with existing medium properties
+			replacement_medium = g.media.update_medium(
+				replacement_medium.id_bytes,
+				medium=replacement_medium,
+				creation_time=medium.creation_time,
+				owner_id=medium.owner_id,
+				status=medium.status,
+				protection=medium.protection,
+				searchability=medium.searchability,
+				group_bits=medium.group_bits,
+				focus=medium.focus,
+			)
+			if not replacement_medium:
+				return ['Medium not found'], None
+			# copy existing tags from original medium
+			g.media.add_tags(replacement_medium.id, medium.tags)
+			#TODO get likes for original medium
+			#TODO add them to replacement medium
+			g.media.remove_medium(medium)
+			medium = replacement_medium
+
+	errors, updates = parse_medium_updates(medium)
+	if errors:
+		return errors, medium
 
 	# catch everything here and return generic error if something goes wrong
 	try:
-		g.media.update_medium(medium.id, **updates)
+		updated_medium = g.media.update_medium(medium.id, medium=medium, **updates)
 	except:
 		errors.append('Problem updating medium')
 		return errors, medium
-
-	# refetch updated medium
-	medium = g.media.get_medium(medium.id_bytes)
+	if not updated_medium:
+		errors.append('Medium not found')
+		return errors, None
+	medium = updated_medium
 
 	if 'generate_summaries' in request.form:
 		# catch everything here and return generic error if something goes wrong
+		# inline generation updates the medium and its uris in place
 		try:
-			g.media.generate_medium_summaries(medium)
+			g.media.queue_medium_summaries(medium)
 		except:
 			#TODO actually return error back up
 			pass
 
-	# refetch updated medium again to populate uris?
-	medium = g.media.get_medium(medium.id_bytes)
-
 	#TODO mass management would flood the logs if edits are logged
 	#TODO think of some better way to log manual edits and maybe single log for mass edits?
 	#subject_id = ''
@@ -895,13 +1277,9 @@ def view_medium(
 	visible_tags = 0
 	clutter_tags = []
 	for tag in medium.tags:
-		clutter_tag = False
-		for clutter_tag_prefix in g.media.config['clutter_tag_prefixes']:
-			if clutter_tag_prefix == tag[:len(clutter_tag_prefix)]:
-				clutter_tag = True
-				clutter_tags.append(tag)
-				break
-		if not clutter_tag:
+		if g.media.is_clutter_tag(tag):
+			clutter_tags.append(tag)
+		else:
 			visible_tags += 1
 	return render_template(
 		'view_medium.html',
@@ -1275,19 +1653,15 @@ def search_media(
 		#TODO can conditionally do things here for some tiny efficiency?
 		pass
 
-	tags_this_page = []
+	# non-clutter tags in order of first appearance with their counts
+	tags_this_page = {}
 	if not hide_tags_this_page:
 		for medium in results.values():
 			for tag in medium.tags:
 				if tag in tags_this_page:
-					continue
-				clutter_tag = False
-				for clutter_tag_prefix in g.media.config['clutter_tag_prefixes']:
-					if clutter_tag_prefix == tag[:len(clutter_tag_prefix)]:
-						clutter_tag = True
-						break
-				if not clutter_tag:
-					tags_this_page.append(tag)
+					tags_this_page[tag] += 1
+				elif not g.media.is_clutter_tag(tag):
+					tags_this_page[tag] = 1
 
 	tag_suggestion_lists = g.media.get_tag_suggestion_lists(
 		management_mode=management_mode,